@@ -0,0 +1,309 @@
+# Benchmarks for the load, rank, store and plot hot paths of name_dash_app.py and name_choropleth_dash_app.py
+#
+# Synthetic SSA format data is generated from the real NamesByState files at 1x, 5x and 20x the number of rows.
+# Each scale runs in its own process, so the apps load that scale's data at import and memory doesn't carry over.
+# Wall time (best of --repeat runs) and peak traced memory (one extra run under tracemalloc) of every
+# scenario are written to a JSON file that can be compared against a saved baseline.
+#
+#   python benchmarks/bench_namesurfer.py --scales 1 5 --output bench.json
+#   python benchmarks/bench_namesurfer.py --scales 1 --baseline bench.json --output bench_new.json
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from name_data import (NAME_COLUMNS, STORE_DIR_NAME, default_workers, list_name_files,  # noqa: E402
+                       load_name_store, read_name_files)
+
+DEFAULT_SCALES = [1, 5, 20]
+DEFAULT_DATA_DIR = REPO_DIR / 'benchmarks' / 'data'
+SOURCE_DIR = REPO_DIR / 'NamesByState'
+NUM_NAMES = [1, 10, 100]
+YEAR_STEPS = [1, 5, 10]
+STATE_SELECTIONS = {'single_state': ['AK'], 'all_states': ['All']}
+SEED = 1910
+
+
+# Synthetic data
+def replica_suffix(r):
+    """
+    Suffix for the names of replica r, 1 -> 'a', 26 -> 'z', 27 -> 'aa'. Replica 0 keeps the real names
+    """
+    suffix = ''
+    while r > 0:
+        r, rem = divmod(r - 1, 26)
+        suffix = chr(ord('a') + rem) + suffix
+    return suffix
+
+
+def generate_synthetic_names(out_dir, scale, source_dir=SOURCE_DIR, seed=SEED):
+    """
+    Write SSA format state files with scale times the rows of source_dir.
+    Replica 0 is the real data, replica r adds every row again with the name suffixed by replica_suffix(r)
+    and the count scaled by a random log-normal factor (never below 5, like SSA). Output is deterministic for a seed.
+    Files that already exist are kept.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for f in list_name_files(source_dir):
+        state_df = pd.read_csv(f, header=None, names=NAME_COLUMNS)
+        # Draw the factors even for existing files so every file gets the same ones as in a fresh run
+        factors = [rng.lognormal(0, 0.5, len(state_df)) for r in range(1, scale)]
+        out_file = out_dir / f.name
+        if out_file.exists():
+            continue
+        tmp_file = out_file.with_suffix('.tmp')
+        state_df.to_csv(tmp_file, header=False, index=False)
+        for r, factor in enumerate(factors, start=1):
+            replica_df = state_df.assign(
+                Name=state_df['Name'] + replica_suffix(r),
+                NumOccurrences=np.maximum(5, np.round(state_df['NumOccurrences'] * factor)).astype(np.int64))
+            replica_df.to_csv(tmp_file, mode='a', header=False, index=False)
+        os.replace(tmp_file, out_file)
+    return out_dir
+
+
+# Measurement
+def measure(fn, repeat):
+    """
+    Run fn repeat times for the best wall time, then once more under tracemalloc for the peak memory.
+    Return (last result, stats dict)
+    """
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start_time)
+    del result
+    gc.collect()
+    tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes
+    tracemalloc.stop()
+    return result, {'wall_s': min(times), 'wall_s_median': float(np.median(times)),
+                    'peak_mb': peak_bytes / 2**20, 'repeat': repeat}
+
+
+def top_names(result_df, n):
+    """
+    The n best ranked names in the last year bucket, so every run picks the same names
+    """
+    return list(result_df.iloc[:, -1].sort_values(kind='stable').head(n).index)
+
+
+def run_scale(scale, data_dir, repeat, reference):
+    """
+    Run every scenario on the data of one scale. Called in a fresh process by main()
+    """
+    names_path = Path(data_dir) / f'scale_{scale}'
+    generate_synthetic_names(names_path, scale)
+    results = {}
+
+    def record(name, fn, times=repeat, **extra):
+        result, stats = measure(fn, times)
+        stats.update(extra)
+        results[name] = stats
+        print(f'  scale {scale:>2}  {name:<55} {stats["wall_s"]:9.4f} s {stats["peak_mb"]:9.1f} MB',
+              file=sys.stderr, flush=True)
+        return result
+
+    # Load
+    def cold_load():
+        shutil.rmtree(names_path / STORE_DIR_NAME, ignore_errors=True)
+        return load_name_store(names_path)
+    record('load_name_files/cold', cold_load, times=1)
+    record('load_name_files/warm', lambda: load_name_store(names_path))
+    files_list = list_name_files(names_path)
+    for workers in sorted({1, default_workers()}):
+        record(f'read_name_files/threads{workers}', lambda: read_name_files(files_list, workers), times=1)
+        if workers > 1:
+            record(f'read_name_files/processes{workers}',
+                   lambda: read_name_files(files_list, workers, use_processes=True), times=1)
+
+    # The choropleth app needs the state rank result, build it before importing the apps
+    from name_choropleth_data import NameIndex, LazyNameIndex, build_state_ranks, read_state_ranks
+    result_path = Path(data_dir) / f'state_ranks_{scale}'
+    def build():
+        shutil.rmtree(result_path, ignore_errors=True)
+        return build_state_ranks(names_path, result_path, range(1910, 2020, 5), partition_by='initial')
+    record('build_state_ranks/initial', build, times=1)
+
+    os.environ['NAMESURFER_NAMES_PATH'] = str(names_path)
+    os.environ['NAMESURFER_RESULT_PATH'] = str(result_path)
+    import name_dash_app
+    import name_choropleth_dash_app
+    import name_figures
+    from name_rank import rank_year_ranges, stream_rank_year_ranges
+    from name_reference import compute_for_year_ranges, compute_name_occurences
+    from name_data import stream_name_chunks
+    names_df = name_dash_app.names_df
+    names_cube = name_dash_app.names_cube
+
+    # Rank
+    record('NameCube/build', lambda: type(names_cube)(names_df))
+    # Bytes per row of names_df and how much of names_df plus names_cube is private to the process
+    report = name_dash_app.memory_report(names_df, names_cube)
+    record('memory_report', lambda: name_dash_app.memory_report(names_df, names_cube), times=1,
+           bytes_per_row=report['bytes_per_row'],
+           private_bytes=report['table']['private_bytes'] + report['cube']['private_bytes'])
+    for selection, states in STATE_SELECTIONS.items():
+        query_states = list(names_df['State'].cat.categories) if states == ['All'] else states
+        record(f'compute_name_occurences/{selection}/1910-1915',
+               lambda: compute_name_occurences(names_df, query_states, ['M', 'F'], range(1910, 1915)))
+        for step in YEAR_STEPS:
+            year_range = range(1910, 2010, step)
+            label = f'{selection}/1910-2010/step{step}'
+            result_df = record(f'rank_year_ranges/{label}',
+                               lambda: rank_year_ranges(names_df, year_range, states, ['M', 'F']))
+            record(f'NameCube.rank_year_ranges/{label}',
+                   lambda: names_cube.rank_year_ranges(year_range, states, ['M', 'F']))
+            if reference and step == 5:
+                reference_df = record(f'compute_for_year_ranges/{label}',
+                                      lambda: compute_for_year_ranges(
+                                          names_df, year_range, states, ['M', 'F']), times=1)
+                reference_df.index = reference_df.index.astype(str)
+                pd.testing.assert_frame_equal(result_df, reference_df, check_index_type=False)
+                results[f'compute_for_year_ranges/{label}']['parity'] = True
+
+    record('stream_rank_year_ranges/all_states/1910-2010/step5', lambda: stream_rank_year_ranges(
+        stream_name_chunks(files_list), range(1910, 2010, 5), ['All'], ['M', 'F']), times=1)
+
+    # Store and plot
+    sexes, states = ['Male', 'Female'], name_dash_app.all_state_names_list
+    key = name_dash_app.filter_key(sexes, states, '1910', '2010', '5')
+    def clear_result_cache():
+        name_dash_app.result_cache.clear(disk=True)
+    def get_rank_table_miss():
+        clear_result_cache()
+        return name_dash_app.get_rank_table(key)
+    def rank_job():
+        # Apply Filters in the background: submit, then poll like the page does until the table is in the cache
+        clear_result_cache()
+        name_dash_app.rank_jobs.submit(key)
+        while name_dash_app.rank_jobs.poll(key)[0] == 'running':
+            time.sleep(0.005)
+    # The first job also starts the workers and builds their NameCubes
+    record('rank_job/first', rank_job, times=1)
+    record('rank_job/submit_to_done', rank_job)
+    record('get_rank_table/miss', get_rank_table_miss)
+    store_data = {'key': key}
+    record('get_rank_table/hit', lambda: name_dash_app.get_rank_table(key), payload_bytes=len(json.dumps(store_data)))
+    result_df = name_dash_app.get_rank_table(key)
+    json_payload = record('rank_table/to_json', lambda: result_df.to_json(date_format='iso', orient='split'))
+    record('rank_table/read_json', lambda: pd.read_json(io.StringIO(json_payload), orient='split'),
+           payload_bytes=len(json_payload))
+
+    stats_df = record('rank_table_stats', lambda: name_dash_app.rank_table_stats(result_df))
+    groups = ['Top 50 New Names', 'Most Variance', 'Presidents', 'First Ladies', 'The Beatles']
+    for n in NUM_NAMES:
+        csv_names = ','.join(top_names(result_df, n))
+        record(f'create_name_superset/{n}_names',
+               lambda: name_dash_app.create_name_superset(set(csv_names.split(',')), groups, stats_df))
+        record(f'plot_name_ranks/{n}_names',
+               lambda: name_dash_app.plot_name_ranks(store_data, csv_names, [], 1))
+
+    # Choropleth
+    state_ranks_df = record('read_state_ranks/eager', lambda: read_state_ranks(result_path))
+    name_index = record('NameIndex/build', lambda: NameIndex(state_ranks_df))
+    app_name_index = name_choropleth_dash_app.result_name_indexes[name_choropleth_dash_app.ALL]
+    for n in NUM_NAMES:
+        names = top_names(result_df, n)
+        record(f'gen_choropleth_for_name_year/eager/{n}_names', lambda: [
+            name_figures.gen_choropleth_for_name_year(name_index, name, 1970) for name in names])
+        record(f'gen_choropleth_for_name_year/lazy_cold/{n}_names', lambda: [
+            name_figures.gen_choropleth_for_name_year(LazyNameIndex(result_path), name, 1970)
+            for name in names])
+        # The index the app picked for the result (lazy for this dataset), warm after the first run
+        record(f'gen_choropleth_for_name_year/app/{n}_names', lambda: [
+            name_figures.gen_choropleth_for_name_year(app_name_index, name, 1970) for name in names])
+        record(f'gen_choropleth_animation_for_name/{n}_names', lambda: [
+            name_figures.gen_choropleth_animation_for_name(name_index, name) for name in names])
+
+    return results
+
+
+# Reporting
+def environment_info():
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Print the wall time ratio of every scenario that is in both runs. Return the scenarios slower than threshold
+    """
+    regressions = []
+    print(f'\n{"scenario":<66} {"baseline":>10} {"current":>10} {"ratio":>7}')
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        ratio = stats['wall_s'] / baseline[name]['wall_s'] if baseline[name]['wall_s'] > 0 else float('inf')
+        flag = '  SLOWER' if ratio > threshold else ''
+        print(f'{name:<66} {baseline[name]["wall_s"]:10.4f} {stats["wall_s"]:10.4f} {ratio:7.2f}{flag}')
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NameSurfer hot paths on synthetic SSA data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help=f'data scales to run (default {DEFAULT_SCALES})')
+    parser.add_argument('--data-dir', default=str(DEFAULT_DATA_DIR),
+                        help='where the synthetic data is generated and kept between runs')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per scenario, the best is kept (default 3)')
+    parser.add_argument('--reference', action='store_true',
+                        help='also time compute_for_year_ranges and check the rank engines give the same result')
+    parser.add_argument('--output', default='bench_results.json', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='wall time ratio above which a scenario counts as a regression (default 1.2)')
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)    # used for the per scale processes
+    args = parser.parse_args()
+
+    if args.run_scale is not None:
+        json.dump(run_scale(args.run_scale, args.data_dir, args.repeat, args.reference), sys.stdout)
+        return
+
+    results = {}
+    for scale in args.scales:
+        cmd = [sys.executable, __file__, '--run-scale', str(scale), '--data-dir', args.data_dir,
+               '--repeat', str(args.repeat)] + (['--reference'] if args.reference else [])
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True)
+        # Progress lines go to stderr as the scenarios run, the JSON results are the last line of stdout
+        scale_results = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.update({f'scale{scale}/{name}': stats for name, stats in scale_results.items()})
+
+    with open(args.output, 'w') as f_h:
+        json.dump({'environment': environment_info(), 'results': results}, f_h, indent=1)
+    print(f'Wrote {len(results)} results to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f_h:
+            baseline = json.load(f_h)['results']
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} scenarios are more than {args.threshold}x slower than the baseline')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
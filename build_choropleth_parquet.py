@@ -0,0 +1,41 @@
+# Command line build of the state names rank parquet dataset used by name_choropleth_dash_app.py
+# Example:
+#   python build_choropleth_parquet.py NamesByState result_all_states_all_names_1910_2020_5 --workers 4
+#   python build_choropleth_parquet.py NamesByState rank_views_1910_2020_5.parquet --views
+import argparse
+import time
+
+from name_choropleth_data import build_rank_views, build_state_ranks
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rank names within every state for each year bucket and write a partitioned parquet dataset. '
+                    'Only the source files changed since the last build are recomputed.')
+    parser.add_argument('names_path', help='directory with the SSA state .TXT files')
+    parser.add_argument('out_dir', help='output dataset directory (output parquet file with --views)')
+    parser.add_argument('--start', type=int, default=1910, help='first year (default 1910)')
+    parser.add_argument('--end', type=int, default=2020, help='end year, not included (default 2020)')
+    parser.add_argument('--step', type=int, default=5, help='years per bucket (default 5)')
+    parser.add_argument('--sexes', default='MF', help='sexes to include, M, F or MF (default MF)')
+    parser.add_argument('--partition-by', choices=['state', 'initial'], default='state',
+                        help='partition by state or by first letter of the name (default state)')
+    parser.add_argument('--workers', type=int, default=1, help='processes to rank changed files with (default 1)')
+    parser.add_argument('--views', action='store_true',
+                        help='write a single tidy file with the ranks of every state and sex plus the both sexes '
+                             'and national rollups, all from one pass. The choropleth app can then switch sex')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    if args.views:
+        rows = build_rank_views(args.names_path, args.out_dir, range(args.start, args.end, args.step),
+                                sexes=list(args.sexes))
+        print(f'Wrote {rows} view rows in {time.perf_counter() - start_time:.1f} s')
+        return
+    ranked = build_state_ranks(args.names_path, args.out_dir, range(args.start, args.end, args.step),
+                               sexes=list(args.sexes), partition_by=args.partition_by, workers=args.workers)
+    print(f'Ranked {len(ranked)} changed source files in {time.perf_counter() - start_time:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# Headless batch export of name rank charts, state choropleths and their rank data, e.g. for reports
+# Example:
+#   python export_names.py NamesByState reports --names John Mary Emma --filter MF All 1910 2020 5 \
+#       --filter F AK,WY 1950 2000 10 --choropleth result_all_states_all_names_1910_2020_5 --format html csv --workers 4
+#
+# Every rank table (one per --filter) and the choropleth rows of the names are computed once in this process.
+# Only the per name slices go to the workers, which build the figures and write the files.
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from name_cache import result_key
+from name_choropleth_data import NameIndex, chunk_list, read_state_ranks
+from name_data import load_name_store
+from name_figures import gen_choropleth_animation_for_name, gen_name_rank_figure
+from name_rank import NameCube
+
+# json and html write the figures, csv writes the ranks they are drawn from
+EXPORT_FORMATS = ['json', 'html', 'csv']
+
+
+def filter_label(key):
+    """
+    Directory name for a result_key, e.g. FM_All_1910_2020_5
+    """
+    sexes, states, start_year, end_year, year_step = key
+    return f'{"".join(sexes)}_{"-".join(states)}_{start_year}_{end_year}_{year_step}'
+
+
+def write_figure(fig, out_base, formats):
+    """
+    Write fig as out_base.json and/or out_base.html. The html loads plotly.js from the CDN
+    so hundreds of files don't each embed it
+    """
+    written = []
+    if 'json' in formats:
+        fig.write_json(out_base.with_suffix('.json'))
+        written.append(out_base.with_suffix('.json'))
+    if 'html' in formats:
+        fig.write_html(out_base.with_suffix('.html'), include_plotlyjs='cdn')
+        written.append(out_base.with_suffix('.html'))
+    return written
+
+
+def export_rank_names(result_df, names, out_dir, formats):
+    """
+    Write the rank chart and/or the ranks of each name in names. result_df holds at least those names.
+    Runs in a worker process
+    """
+    written = []
+    for name in names:
+        out_base = out_dir / name
+        written += write_figure(gen_name_rank_figure(result_df, [name]), out_base, formats)
+        if 'csv' in formats:
+            result_df.loc[name].rename('Rank').rename_axis('Year').to_csv(out_base.with_suffix('.csv'))
+            written.append(out_base.with_suffix('.csv'))
+    return written
+
+
+def export_choropleth_names(state_ranks_df, names, out_dir, formats):
+    """
+    Write the animated state map and/or the state x year ranks of each name in names.
+    state_ranks_df holds at least those names. Runs in a worker process
+    """
+    name_index = NameIndex(state_ranks_df)
+    written = []
+    for name in names:
+        out_base = out_dir / name
+        written += write_figure(gen_choropleth_animation_for_name(name_index, name), out_base, formats)
+        if 'csv' in formats:
+            state_ranks_df.xs(name, level='names').to_csv(out_base.with_suffix('.csv'))
+            written.append(out_base.with_suffix('.csv'))
+    return written
+
+
+def run_jobs(jobs, workers):
+    """
+    Run (function, args) jobs, on a process pool if workers > 1. Return all the written files
+    """
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(func, *args) for func, args in jobs]
+            return [f for future in futures for f in future.result()]
+    return [f for func, args in jobs for f in func(*args)]
+
+
+def export_names(names, filter_keys, out_dir, names_path=None, choropleth_path=None,
+                 formats=('html',), workers=1):
+    """
+    Export every name in names for every filter set in filter_keys (result_key tuples) to
+    out_dir/ranks/<filter_label>/<name>.<format>, and if choropleth_path is given (the result used by
+    name_choropleth_dash_app.py) to out_dir/choropleth/<name>.<format>.
+    Each rank table is computed once from a NameCube of the names in names_path. The names are split
+    into workers chunks and each chunk gets only its rows.
+    Return (written files, {output directory: names with no data})
+    """
+    out_dir = Path(out_dir)
+    names = list(dict.fromkeys(names))    # Drop duplicates, keep the order
+    jobs = []
+    missing = {}
+
+    if filter_keys:
+        names_cube = NameCube(load_name_store(names_path))
+        for key in filter_keys:
+            sexes, states, start_year, end_year, year_step = key
+            result_df = names_cube.rank_year_ranges(range(start_year, end_year, year_step), list(states), list(sexes))
+            key_dir = out_dir / 'ranks' / filter_label(key)
+            key_dir.mkdir(parents=True, exist_ok=True)
+            found = [n for n in names if n in result_df.index]
+            missing[key_dir] = [n for n in names if n not in result_df.index]
+            for chunk in chunk_list(found, workers):
+                jobs.append((export_rank_names, (result_df.loc[chunk], chunk, key_dir, formats)))
+
+    if choropleth_path is not None:
+        # Read only the rows of the requested names
+        state_ranks_df = read_state_ranks(choropleth_path, filters=[('names', 'in', names)])
+        map_dir = out_dir / 'choropleth'
+        map_dir.mkdir(parents=True, exist_ok=True)
+        present = set(state_ranks_df.index.get_level_values('names'))
+        found = [n for n in names if n in present]
+        missing[map_dir] = [n for n in names if n not in present]
+        for chunk in chunk_list(found, workers):
+            rows = state_ranks_df.index.get_level_values('names').isin(chunk)
+            jobs.append((export_choropleth_names, (state_ranks_df[rows], chunk, map_dir, formats)))
+
+    return run_jobs(jobs, workers), {d: m for d, m in missing.items() if m}
+
+
+def read_names_file(names_file):
+    """
+    Names from a text file, one per line or comma separated
+    """
+    text = Path(names_file).read_text()
+    return [n.strip() for n in text.replace(',', '\n').splitlines() if n.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write rank charts, state choropleths and their rank data for a list of names without '
+                    'running the Dash apps. Each rank table is computed once and shared by all the names.')
+    parser.add_argument('names_path', help='directory with the SSA state .TXT files')
+    parser.add_argument('out_dir', help='output directory')
+    parser.add_argument('--names', nargs='+', default=[], help='names to export')
+    parser.add_argument('--names-file', help='text file of names to export, one per line or comma separated')
+    parser.add_argument('--filter', nargs=5, action='append', default=[],
+                        metavar=('SEXES', 'STATES', 'START', 'END', 'STEP'),
+                        help='a rank table to chart, e.g. MF All 1910 2020 5 or F AK,WY 1950 2000 10. '
+                             'END is not included. Can be repeated')
+    parser.add_argument('--choropleth', help='state rank result (parquet file, build_choropleth_parquet.py dataset '
+                                             'or --views file, which uses both sexes) to draw the state maps from')
+    parser.add_argument('--format', nargs='+', choices=EXPORT_FORMATS, default=['html'],
+                        help='json and html write figures, csv writes the ranks (default html)')
+    parser.add_argument('--workers', type=int, default=1, help='processes writing the files (default 1)')
+    args = parser.parse_args()
+
+    names = args.names + (read_names_file(args.names_file) if args.names_file else [])
+    if not names:
+        parser.error('no names given, use --names or --names-file')
+    if not args.filter and not args.choropleth:
+        parser.error('nothing to export, use --filter and/or --choropleth')
+    filter_keys = [result_key(list(sexes), states.split(','), start_year, end_year, year_step)
+                   for sexes, states, start_year, end_year, year_step in args.filter]
+
+    start_time = time.perf_counter()
+    written, missing = export_names(names, filter_keys, args.out_dir, names_path=args.names_path,
+                                    choropleth_path=args.choropleth, formats=args.format, workers=args.workers)
+    print(f'Wrote {len(written)} files to {args.out_dir} in {time.perf_counter() - start_time:.1f} s')
+    for out_dir, names in missing.items():
+        print(f'No data in {out_dir} for: {", ".join(names)}')
+
+
+if __name__ == '__main__':
+    main()
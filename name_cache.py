@@ -0,0 +1,174 @@
+# Cache of computed name rank DataFrames
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+
+def result_key(sexes, states, start_year, end_year, year_step):
+    """
+    Normalized cache key for a filter selection. Order and duplicates in sexes and states don't matter
+    """
+    return (tuple(sorted(set(sexes))), tuple(sorted(set(states))),
+            int(start_year), int(end_year), int(year_step))
+
+
+def df_nbytes(df):
+    """
+    Memory used by a DataFrame including its index
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ResultCache:
+    """
+    LRU cache of DataFrames bounded by max_bytes of memory.
+    If cache_dir is given, entries are also written there as pickles so every worker process
+    pointed at the same local directory can reuse them. The directory is pruned, oldest first,
+    when it goes over max_disk_bytes (None means no limit).
+    The counters returned by stats() are for sizing max_bytes.
+    namespace is part of the disk file names. Pass something that changes with the data
+    (e.g. name_data.source_tag) so results computed from older data aren't read back after an update.
+    """
+
+    def __init__(self, max_bytes, cache_dir=None, max_disk_bytes=None, namespace=''):
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._entries = OrderedDict()    # key -> (df, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk_file(self, key):
+        digest = hashlib.sha1(repr((self.namespace, key)).encode()).hexdigest()
+        return self.cache_dir / f'{digest}.pkl'
+
+    def _put_memory(self, key, df):
+        nbytes = df_nbytes(df)
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        if nbytes > self.max_bytes:
+            return    # Too big to keep in memory at all
+        self._entries[key] = (df, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            _, (_, old_nbytes) = self._entries.popitem(last=False)
+            self._bytes -= old_nbytes
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        f = self._disk_file(key)
+        try:
+            df = pd.read_pickle(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            # Truncated or corrupt, remove it so it is computed and written again
+            try:
+                f.unlink()
+            except OSError:
+                pass
+            return None
+        os.utime(f)    # Keep recently used files when pruning
+        return df
+
+    def _write_disk(self, key, df):
+        if self.cache_dir is None:
+            return
+        f = self._disk_file(key)
+        # Write to a temporary file and rename so other workers never read a partial file
+        tmp = f.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        df.to_pickle(tmp)
+        os.replace(tmp, f)
+        if self.max_disk_bytes is not None:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        files = []
+        for f in self.cache_dir.glob('*.pkl'):
+            try:
+                st = f.stat()
+            except OSError:
+                continue    # Removed by another worker
+            files.append((st.st_mtime, st.st_size, f))
+        total = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files, key=lambda e: e[0]):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                f.unlink()
+            except OSError:
+                pass
+            total -= size
+
+    def get(self, key):
+        """
+        Return the cached DataFrame for key or None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+        df = self._read_disk(key)
+        with self._lock:
+            if df is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._put_memory(key, df)
+        return df
+
+    def put(self, key, df):
+        with self._lock:
+            self._put_memory(key, df)
+        self._write_disk(key, df)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached DataFrame for key, calling compute() and caching its result on a miss
+        """
+        df = self.get(key)
+        if df is None:
+            df = compute()
+            self.put(key, df)
+        return df
+
+    def clear(self, disk=False):
+        """
+        Drop every entry kept in memory. With disk=True the files in cache_dir are removed too
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if disk and self.cache_dir is not None:
+            for f in self.cache_dir.glob('*.pkl'):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass    # Removed by another worker
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
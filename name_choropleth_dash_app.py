@@ -1,58 +1,71 @@
 # Import required libraries
-import pandas as pd
+import os
 from pathlib import Path
 from dash import Dash, html, dcc, Input, Output, State
 from dash.exceptions import PreventUpdate
 import plotly.express as px
 import plotly.graph_objects as go
+from functools import lru_cache
+from name_choropleth_data import (LazyNameIndex, NameIndex, is_rank_views, is_sorted_by_name, read_rank_views,
+                                  read_state_ranks)
+from name_rank import ALL, rank_view
+from name_figures import gen_choropleth_animation_for_name
+from name_search import NameSearchIndex
+from flask import jsonify
+from name_metrics import instrumented_callback, metrics
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 
-# Load the state names result parquet file
+# Load the state names result parquet file. This can also be the dataset directory written by build_choropleth_parquet.py,
+# or the rank views file from build_choropleth_parquet.py --views, which also has the ranks of each sex
 files_path = 'E:/UserLo/source/repos/learning/Name Surfer/'
 result_parquet_file = "result_all_states_all_names_1910_2020_5.parquet"
-result_parquet_df=pd.read_parquet(files_path+result_parquet_file)
-
-def gen_choropleth_for_name_year(result_df,name,year):
+# NAMESURFER_RESULT_PATH overrides the result file or dataset directory, e.g. for the benchmarks
+result_path = os.environ.get('NAMESURFER_RESULT_PATH', files_path+result_parquet_file)
+# With RESULT_LAZY_LOAD nothing is read at startup. Each name lookup reads only the parquet row groups
+# that can have the name and the most recently used names are kept in memory. This needs rows sorted by name,
+# as written by build_choropleth_parquet.py (fastest with --partition-by initial), so it is only used for those.
+# Otherwise, e.g. for the notebook's file sorted by state, the whole result is read into memory and indexed by name.
+RESULT_LAZY_LOAD = is_sorted_by_name(result_path)
+HOT_NAME_CACHE_SIZE = 256
+# Sex choices shown above the map -> sex view of a rank views file. Other results only have Both
+SEX_VIEWS = {'Both': ALL, 'Female': 'F', 'Male': 'M'}
+sex_choices = list(SEX_VIEWS) if is_rank_views(result_path) else ['Both']
+if RESULT_LAZY_LOAD:
+    result_name_indexes = {SEX_VIEWS[choice]: LazyNameIndex(result_path, cache_size=HOT_NAME_CACHE_SIZE, sex=SEX_VIEWS[choice])
+                           for choice in sex_choices}
+elif len(sex_choices) > 1:
+    # Every view is a slice of the one views table, nothing is ranked again
+    views_df, views_year_range = read_rank_views(result_path)
+    result_name_indexes = {SEX_VIEWS[choice]: NameIndex(rank_view(views_df, views_year_range, None, SEX_VIEWS[choice]))
+                           for choice in sex_choices}
+else:
+    result_parquet_df=read_state_ranks(result_path)
+    # Per name index of result_parquet_df so the slider doesn't scan the whole DataFrame for every year
+    result_name_indexes = {ALL: NameIndex(result_parquet_df)}
+
+# Prefix and typo search over the names in the result, names ranked in more states first
+name_search = NameSearchIndex(*result_name_indexes[ALL].name_counts())
+
+# Number of names whose animated figures are kept in memory on the server
+FIGURE_CACHE_SIZE = 64
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def cached_choropleth_animation(name, sex=ALL):
     """
-    gen_choropleth_for_name_year
-    Using the previously computed state names result DataFrame, generate a choropleth map of USA states showing the ranking by state.
-
-    Return:
-    Plotly Graph Objects Figure
+    Serialized animated figure for name from the sex view in result_name_indexes. Recently requested names stay cached
     """
-    if type(year)!=str:
-        year = f'{year:4.0f}'
-    color_max = result_df.xs(name, level=("names"), axis=0).max().max()
-    color_max = min(color_max, 500)
-    color_min = result_df.xs(name, level=("names"), axis=0).min().min()
-    fig = go.Figure(data=go.Choropleth(
-        locations=list(result_df.xs(name, level=("names"), axis=0).index), # Spatial coordinates
-        z = result_df.xs(name, level=("names"), axis=0).loc[:,year], # Data to be color-coded
-
-        # The built-in Plotly geojson for USA is lower resolution, but much faster to render than states_geojson_clean_dict
-        # If you want to switch, comment out locationmode and uncomment geojson and featureidkey
-        locationmode = 'USA-states', # set of locations match entries in `locations`
-        #geojson=states_geojson_clean_dict, 
-        #featureidkey="properties.Abbreviation",
-
-        colorscale = 'Viridis',
-        reversescale=True,
-        zmin=color_min, zmax = color_max,
-        colorbar=dict(title='Name Popularity Rank',
-        )
-    ))
+    return gen_choropleth_animation_for_name(result_name_indexes[sex], name).to_dict()
 
-    fig.update_layout(
-        geo_scope='usa', # limit map scope to USA
-        title_text = f'{year} Popularity Rank for {name} by State')
 
-    # fig.update_coloraxes(colorbar=dict(orientation='h'))
-
-
-    return fig
+@app.server.route('/metrics')
+def metrics_snapshot():
+    """
+    Per stage timings and the recent callbacks, recorded when NAMESURFER_METRICS=1 (see name_metrics.py)
+    """
+    return jsonify(metrics.snapshot())
 
 
 # Create an app layout.
@@ -74,37 +87,60 @@ app.layout = html.Div(children=[
     html.Div(children=[
         html.Label(
             'Enter First Name '),
+        # The value updates on every character for the suggestions in the datalist,
+        # but the figure is only built after Enter or leaving the box (n_submit, n_blur)
         dcc.Input(placeholder='Enter Name...',
-                  value='John', type='text', id='first-name'),
+                  value='John', type='text', id='first-name', list='first-name-suggestions'),
+        html.Datalist(id='first-name-suggestions'),
+        html.Div(id='first-name-did-you-mean'),
+        dcc.RadioItems(options=sex_choices, value='Both', id='sex-view', inline=True),
 
     ], style={'padding': 10, 'flex': 1}),
 
     html.Div([
         dcc.Graph(id='name-choropleth')
     ],id='graph-div',style={'padding': '0 20'}),
-    html.Div([
-        dcc.Slider(1910, 2015, 5,
-               value=1910,
-               marks={i: f'{i:4d}' for i in range(1910, 2020, 5)},
-               updatemode='drag',
-               id='year-slider'
-        ),
-        html.Div(["Select year to display"], style={'padding': 10, 'flex': 1})
-
-    ]),
+    # The year slider is part of the figure. All the years are sent at once as animation frames
+    html.Div(["Select year to display with the slider under the map, or click Play"], style={'padding': 10, 'flex': 1}),
 
     html.Br(),
 
 ])
 
 @app.callback(
-    Output(component_id='name-choropleth', component_property='figure'),
-    State(component_id='first-name', component_property='value'),
-    Input(component_id='year-slider', component_property='value')
+    Output(component_id='first-name-suggestions', component_property='children'),
+    Input(component_id='first-name', component_property='value')
 )
-def plot_choropleth(name, year):
+@instrumented_callback()
+def suggest_first_name(name):
+    if not name:
+        return []
+    return [html.Option(value=n) for n in name_search.prefix(name)]
+
 
-    return gen_choropleth_for_name_year(result_parquet_df,name,year)
+@app.callback(
+    Output(component_id='name-choropleth', component_property='figure'),
+    Output(component_id='first-name-did-you-mean', component_property='children'),
+    Input(component_id='first-name', component_property='n_submit'),
+    Input(component_id='first-name', component_property='n_blur'),
+    Input(component_id='sex-view', component_property='value'),
+    State(component_id='first-name', component_property='value')
+)
+@instrumented_callback()
+def plot_choropleth(n_submit, n_blur, sex_choice, name):
+    if not name:
+        raise PreventUpdate
+
+    # Accept the name in any case, e.g. john
+    found = name_search.match(name)
+    if found is None:
+        did_you_mean = name_search.did_you_mean(name)
+        message = f'No data for {name.strip()}.' + (f' Did you mean {", ".join(did_you_mean)}?' if did_you_mean else '')
+        return go.Figure(), message
+    fig = cached_choropleth_animation(found, SEX_VIEWS[sex_choice])
+    if not fig['data']:
+        return fig, f'No {sex_choice.lower()} data for {found}.'
+    return fig, ''
 
 # Run the app
 if __name__ == '__main__':
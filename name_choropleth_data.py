@@ -0,0 +1,432 @@
+# Build, load and look up the state names rank result used by name_choropleth_dash_app.py
+import json
+import shutil
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from name_data import list_name_files, load_name_store, read_name_files, source_signature
+from name_metrics import timed
+from name_rank import ALL, affected_buckets, extend_year_range, rank_view, rank_views, rank_year_ranges_by_state
+
+# Color scale upper bound used by the choropleth, ranks above this all get the same color
+COLOR_MAX_LIMIT = 500
+
+# Everything the choropleth needs for one name.
+# locations: state abbreviations, ranks: (state x year) array, years: column labels of ranks
+NameBlock = namedtuple('NameBlock', ['name', 'locations', 'years', 'ranks', 'color_min', 'color_max'])
+
+
+class BaseNameIndex:
+    """
+    What NameIndex and LazyNameIndex share. years are the column labels of the blocks' ranks
+    and year_col maps each label to its column
+    """
+
+    def year_ranks(self, block, year):
+        """
+        Ranks of every state in block for year. year can be an int or the column label
+        """
+        if type(year) != str:
+            year = f'{year:4.0f}'
+        return block.ranks[:, self.year_col[year]]
+
+
+class NameIndex(BaseNameIndex):
+    """
+    Per name index of the state names rank result DataFrame.
+    The DataFrame has a MultiIndex ('st_abb', 'names') and one column of ranks per year, e.g. '1910'.
+    The rows are sorted by name once, then a name lookup is a dict lookup plus a slice
+    of one float32 array. The color bounds of every name are computed up front.
+    """
+
+    def __init__(self, result_df):
+        names = result_df.index.get_level_values('names').to_numpy(dtype=object)
+        states = result_df.index.get_level_values('st_abb').to_numpy(dtype=object)
+        order = np.argsort(names, kind='stable')
+        names = names[order]
+        self.states = states[order]
+        self.ranks = result_df.to_numpy(dtype=np.float32)[order]
+        self.years = [str(c) for c in result_df.columns]
+        self.year_col = {y: i for i, y in enumerate(self.years)}
+
+        # Start and stop of each run of equal names in the sorted rows
+        starts = np.nonzero(np.r_[True, names[1:] != names[:-1]])[0] if len(names) else np.zeros(0, dtype=np.int64)
+        stops = np.r_[starts[1:], len(names)].astype(np.int64)
+        self.offsets = {n: (i, a, b) for i, (n, a, b) in enumerate(zip(names[starts], starts, stops))}
+
+        # fmin/fmax skip NaN, so a name with no ranks at all gets NaN bounds
+        self.color_min = np.full(len(starts), np.nan, dtype=np.float32)
+        self.color_max = np.full(len(starts), np.nan, dtype=np.float32)
+        # Number of ranked (state, year bucket) cells of every name, the popularity weight of name_counts
+        self.ranked_cells = np.zeros(len(starts), dtype=np.int64)
+        if len(starts):
+            self.color_min = np.fmin.reduceat(np.fmin.reduce(self.ranks, axis=1), starts)
+            self.color_max = np.fmax.reduceat(np.fmax.reduce(self.ranks, axis=1), starts)
+            self.ranked_cells = np.add.reduceat((~np.isnan(self.ranks)).sum(axis=1), starts)
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def lookup(self, name):
+        """
+        Return the NameBlock for name, or None if name isn't in the result
+        """
+        if name not in self.offsets:
+            return None
+        i, a, b = self.offsets[name]
+        return NameBlock(name, list(self.states[a:b]), self.years, self.ranks[a:b],
+                         float(self.color_min[i]), float(min(self.color_max[i], COLOR_MAX_LIMIT)))
+
+    def name_counts(self):
+        """
+        Return (names, number of ranked (state, year bucket) cells of each name), e.g. as the popularity weights
+        of a name_search.NameSearchIndex. Names ranked in every state for every year bucket come first,
+        counting only the states would tie hundreds of common names
+        """
+        return list(self.offsets), self.ranked_cells
+
+
+class LazyNameIndex(BaseNameIndex):
+    """
+    Same lookups as NameIndex, but nothing is read up front.
+    The result is opened as a pyarrow dataset (the single parquet file or a build_state_ranks directory).
+    A lookup reads only the rows of that name: the filter on names skips the row groups whose min/max
+    statistics can't contain it, and for the initial=X layout whole partitions are skipped.
+    The blocks of the most recently used names are kept in an LRU cache of cache_size names.
+    path can also be a rank views table from build_rank_views, then the lookups are for the states of one
+    sex view ('M', 'F' or 'All' for both).
+    """
+
+    def __init__(self, path, cache_size=256, sex=ALL):
+        self.path = Path(path)
+        self.dataset = ds.dataset(self.path, format='parquet', partitioning='hive')
+        self.sex = sex
+        self.year_range = rank_views_year_range(self.dataset.schema)
+        if self.year_range is not None:
+            self.partition_cols = []
+            self.years = [f'{yr}' for yr in self.year_range]
+        else:
+            self.partition_cols = [c for c in ['initial'] if c in self.dataset.schema.names]
+            self.years = [c for c in self.dataset.schema.names
+                          if c not in ['st_abb', 'names', 'initial', '__index_level_0__']]
+        self.year_col = {y: i for i, y in enumerate(self.years)}
+        self._cached_lookup = lru_cache(maxsize=cache_size)(self._read_block)
+
+    def _view_filter(self):
+        # The states (not the national rollup) of the sex view
+        return (ds.field('Sex') == self.sex) & (ds.field('State') != ALL)
+
+    def _read_view_block(self, name):
+        table = self.dataset.to_table(columns=['State', 'Year', 'Rank'],
+                                      filter=(ds.field('Name') == name) & self._view_filter())
+        if table.num_rows == 0:
+            return None
+        states, state_row = np.unique(table.column('State').to_numpy(zero_copy_only=False), return_inverse=True)
+        bucket = (table.column('Year').to_numpy().astype(np.int64) - self.year_range.start) // self.year_range.step
+        ranks = np.full((len(states), len(self.years)), np.nan, dtype=np.float32)
+        ranks[state_row, bucket] = table.column('Rank').to_numpy()
+        return NameBlock(name, list(states), self.years, ranks,
+                         float(np.fmin.reduce(ranks, axis=None)),
+                         float(min(np.fmax.reduce(ranks, axis=None), COLOR_MAX_LIMIT)))
+
+    @timed('LazyNameIndex.read_block')
+    def _read_block(self, name):
+        if self.year_range is not None:
+            return self._read_view_block(name)
+        row_filter = ds.field('names') == name
+        if 'initial' in self.partition_cols:
+            row_filter = row_filter & (ds.field('initial') == name[:1])
+        table = self.dataset.to_table(columns=['st_abb'] + self.years, filter=row_filter)
+        if table.num_rows == 0:
+            return None
+        states = np.array([str(st) for st in table.column('st_abb').to_pylist()], dtype=object)
+        order = np.argsort(states, kind='stable')
+        ranks = np.column_stack([table.column(y).to_numpy(zero_copy_only=False) for y in self.years]) \
+            .astype(np.float32)[order]
+        color_min = np.fmin.reduce(ranks, axis=None)
+        color_max = np.fmax.reduce(ranks, axis=None)
+        return NameBlock(name, list(states[order]), self.years, ranks,
+                         float(color_min), float(min(color_max, COLOR_MAX_LIMIT)))
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def name_counts(self):
+        """
+        Return (names, number of ranked (state, year bucket) cells of each name), the same as NameIndex.name_counts.
+        For a rank views table every row of the sex view is one cell and only the Name column is read
+        """
+        if self.year_range is not None:
+            names = self.dataset.to_table(columns=['Name'], filter=self._view_filter()).column('Name')
+            counts = pc.value_counts(names.combine_chunks().cast(pa.string()))
+            return counts.field('values').to_pylist(), counts.field('counts').to_numpy()
+        table = self.dataset.to_table(columns=['names'] + self.years)
+        cells = np.zeros(table.num_rows, dtype=np.int64)
+        for y in self.years:
+            cells += table.column(y).is_valid().to_numpy(zero_copy_only=False)
+        totals = pa.table({'names': table.column('names').combine_chunks().cast(pa.string()), 'cells': cells}) \
+            .group_by('names').aggregate([('cells', 'sum')])
+        return totals.column('names').to_pylist(), totals.column('cells_sum').to_numpy()
+
+    def lookup(self, name):
+        """
+        Return the NameBlock for name, or None if name isn't in the result
+        """
+        return self._cached_lookup(name)
+
+
+# Rows per parquet row group. Rows are sorted by name, so the names min/max statistics of
+# each row group let a reader skip the row groups that can't have a given name
+ROW_GROUP_SIZE = 4096
+BUILD_MANIFEST = '_build_manifest.json'
+
+
+def rank_state_files(files_list, year_range, sexes):
+    """
+    Read the given state files and rank names within each state. Runs in a worker process when the build fans out
+    """
+    return rank_year_ranges_by_state(read_name_files(files_list), year_range, sexes)
+
+
+def write_partition(df, partition_dir):
+    """
+    Write one partition as a single parquet file sorted by name, replacing whatever was there
+    """
+    if partition_dir.exists():
+        shutil.rmtree(partition_dir)
+    partition_dir.mkdir(parents=True)
+    df.sort_values(['names', 'st_abb'] if 'st_abb' in df.columns else ['names']) \
+        .to_parquet(partition_dir / 'part-0.parquet', index=False, row_group_size=ROW_GROUP_SIZE)
+
+
+# Columns of a rank views table that hold the st_abb and names of read_state_ranks
+VIEWS_COLUMNS = {'st_abb': 'State', 'names': 'Name'}
+
+
+def read_state_ranks(path, filters=None):
+    """
+    Read the state names rank result, either the single parquet file written by name_choropleth.ipynb,
+    a dataset directory written by build_state_ranks or the Both view of a rank views table from build_rank_views.
+    filters on st_abb and names is passed to pd.read_parquet.
+    Return DataFrame with MultiIndex ('st_abb', 'names') and one column per year
+    """
+    path = Path(path)
+    if path.is_file() and is_rank_views(path):
+        if filters is not None:
+            filters = [(VIEWS_COLUMNS.get(col, col), op, value) for col, op, value in filters]
+        views_df = pd.read_parquet(path, filters=filters)
+        return rank_view(views_df, rank_views_year_range(pq.read_schema(path)), None, ALL)
+    if path.is_file():
+        return pd.read_parquet(path, filters=filters)
+    df = pd.read_parquet(path, filters=filters)
+    df['st_abb'] = df['st_abb'].astype(str)
+    df = df.drop(columns=[c for c in ['initial'] if c in df.columns])
+    return df.set_index(['st_abb', 'names']).sort_index()
+
+
+def chunk_list(items, num_chunks):
+    """
+    Split items into at most num_chunks lists of about the same length
+    """
+    num_chunks = max(1, min(num_chunks, len(items)))
+    return [items[i::num_chunks] for i in range(num_chunks)]
+
+
+def build_state_ranks(files_path, out_dir, year_range, sexes=('M', 'F'), partition_by='state', workers=1):
+    """
+    Build the state names rank result as a parquet dataset in out_dir, partitioned by state
+    (out_dir/st_abb=AK/...) or by first letter of the name (out_dir/initial=J/...).
+
+    Only source files that were added or changed since the last build (mtime or size, see name_data.py) are
+    read and ranked, and only the partitions they touch are rewritten. A different year_range, sexes or
+    partition_by rebuilds everything. With workers > 1 the changed files are ranked on a process pool.
+    Return the list of source file names that were ranked
+    """
+    if partition_by not in ('state', 'initial'):
+        raise ValueError("partition_by must be 'state' or 'initial'")
+
+    out_dir = Path(out_dir)
+    files_list = list_name_files(files_path)
+    signature = source_signature(files_list)
+    settings = {'year_range': [year_range.start, year_range.stop, year_range.step],
+                'sexes': sorted(sexes), 'partition_by': partition_by}
+
+    manifest = {}
+    manifest_file = out_dir / BUILD_MANIFEST
+    if manifest_file.exists():
+        with manifest_file.open("r") as f_h:
+            manifest = json.load(f_h)
+    if manifest.get('settings') != settings:
+        if out_dir.exists():
+            shutil.rmtree(out_dir)
+        manifest = {'settings': settings, 'sources': {}}
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    old_sources = manifest['sources']
+    changed = [f for f in files_list if old_sources.get(f.name) != signature[f.name]]
+    removed = [n for n in old_sources if n not in signature]
+    # SSA names each file after its state (AK.TXT has the AK rows), these states' old rows are no longer valid
+    stale_states = {Path(n).stem.upper() for n in [f.name for f in changed] + removed}
+
+    # Rank the changed files, one grouped pass per chunk of files
+    chunks = chunk_list(changed, workers)
+    if len(changed) == 0:
+        parts = []
+    elif workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(rank_state_files, chunks, [year_range] * len(chunks), [list(sexes)] * len(chunks)))
+    else:
+        parts = [rank_state_files(chunk, year_range, list(sexes)) for chunk in chunks]
+    new_df = pd.concat(parts).reset_index() if parts else pd.DataFrame(columns=['st_abb', 'names'])
+    stale_states |= set(new_df['st_abb'])
+
+    if partition_by == 'state':
+        for st in stale_states:
+            partition_dir = out_dir / f'st_abb={st}'
+            if partition_dir.exists():
+                shutil.rmtree(partition_dir)
+        for st, st_df in new_df.groupby('st_abb'):
+            write_partition(st_df.drop(columns=['st_abb']), out_dir / f'st_abb={st}')
+    else:
+        new_df['initial'] = new_df['names'].str[0]
+        initials = set(new_df['initial'])
+        if len(stale_states) > 0 and any(out_dir.glob('initial=*')):
+            # Partitions that have old rows of the stale states also need to be rewritten
+            old_df = pd.read_parquet(out_dir, columns=['st_abb', 'names'], filters=[('st_abb', 'in', sorted(stale_states))])
+            initials |= set(old_df['names'].str[0])
+        for initial in sorted(initials):
+            partition_dir = out_dir / f'initial={initial}'
+            if partition_dir.exists():
+                kept_df = read_state_ranks(partition_dir).reset_index()
+                kept_df = kept_df[~kept_df['st_abb'].isin(stale_states)]
+            else:
+                kept_df = None
+            initial_df = pd.concat([kept_df, new_df[new_df['initial'] == initial].drop(columns=['initial'])])
+            if len(initial_df) == 0:
+                shutil.rmtree(partition_dir, ignore_errors=True)
+            else:
+                write_partition(initial_df, partition_dir)
+
+    manifest['sources'] = signature
+    with manifest_file.open("w") as f_h:
+        json.dump(manifest, f_h)
+    return [f.name for f in changed]
+
+
+# Key of the year range in the schema metadata of a rank views table
+VIEWS_YEAR_RANGE_KEY = b'namesurfer.year_range'
+
+
+def rank_views_year_range(schema):
+    """
+    year_range of a rank views table from its parquet schema, None if it isn't one
+    """
+    metadata = schema.metadata or {}
+    if VIEWS_YEAR_RANGE_KEY not in metadata:
+        return None
+    return range(*json.loads(metadata[VIEWS_YEAR_RANGE_KEY]))
+
+
+def is_rank_views(path):
+    """
+    True if path is a rank views table from build_rank_views rather than a read_state_ranks result
+    """
+    return rank_views_year_range(ds.dataset(path, format='parquet', partitioning='hive').schema) is not None
+
+
+def is_sorted_by_name(path):
+    """
+    True if the rows of path are sorted by name, so a LazyNameIndex lookup only reads the row groups of one name:
+    a dataset directory from build_state_ranks or a rank views table. The single parquet file of
+    name_choropleth.ipynb is sorted by state, every lookup would scan all of it
+    """
+    path = Path(path)
+    if path.is_dir():
+        return (path / BUILD_MANIFEST).exists()
+    return is_rank_views(path)
+
+
+def build_rank_views(files_path, out_file, year_range, sexes=('M', 'F')):
+    """
+    Write name_rank.rank_views of the state files in files_path as a single tidy parquet file:
+    ranks for every (state, sex, year bucket) plus both sexes of each state and the national rollups,
+    from one grouped pass. Rows are sorted by name so the row group statistics let LazyNameIndex read one name.
+    The year range is saved in the schema metadata. Return the number of rows
+    """
+    views_df = rank_views(load_name_store(files_path), year_range, sexes)
+    views_df = views_df.sort_values(['Name', 'State', 'Sex', 'Year'], kind='stable')
+    table = pa.Table.from_pandas(views_df, preserve_index=False)
+    # Plain string columns, the dataset filters only skip row groups on those (parquet dictionary encodes them anyway)
+    table = table.cast(pa.schema([pa.field(f.name, pa.string()) if pa.types.is_dictionary(f.type) else f
+                                  for f in table.schema], metadata=table.schema.metadata))
+    year_range_json = json.dumps([year_range.start, year_range.stop, year_range.step]).encode()
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), VIEWS_YEAR_RANGE_KEY: year_range_json})
+    out_file = Path(out_file)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, out_file, row_group_size=ROW_GROUP_SIZE)
+    return len(views_df)
+
+
+def read_rank_views(path):
+    """
+    Return (views DataFrame, year_range) of a table written by build_rank_views.
+    name_rank.rank_view turns one of its views into the wide layout of read_state_ranks
+    """
+    table = pq.read_table(path)
+    return table.to_pandas(), rank_views_year_range(table.schema)
+
+
+def update_state_ranks_years(names_df, out_dir, years, files_path=None):
+    """
+    Update a dataset written by build_state_ranks after the rows of years were added to names_df
+    (see name_data.append_name_years). Only the year bucket columns that contain years are recomputed,
+    from just the rows of those buckets, the other columns are copied as they are. Every partition has
+    columns of the recomputed buckets, so the whole dataset is read and every partition is rewritten.
+    The year range of the build is extended to cover years. If files_path is given, the manifest records its files as built,
+    so the next build_state_ranks run doesn't rank them again.
+    Return the list of bucket columns that were recomputed
+    """
+    out_dir = Path(out_dir)
+    with (out_dir / BUILD_MANIFEST).open("r") as f_h:
+        manifest = json.load(f_h)
+    settings = manifest['settings']
+    year_range = extend_year_range(range(*settings['year_range']), years)
+
+    state_ranks_df = read_state_ranks(out_dir)
+    buckets = affected_buckets(year_range, years)
+    year_values = names_df['Year'].to_numpy()
+    for start_year in buckets:
+        bucket_range = range(start_year, start_year + year_range.step, year_range.step)
+        in_bucket = (year_values >= start_year) & (year_values < start_year + year_range.step)
+        bucket_df = rank_year_ranges_by_state(names_df[in_bucket], bucket_range, settings['sexes'])
+        state_ranks_df = state_ranks_df.reindex(state_ranks_df.index.union(bucket_df.index))
+        state_ranks_df[f'{start_year}'] = bucket_df[f'{start_year}']
+    state_ranks_df = state_ranks_df[[f'{yr}' for yr in year_range if f'{yr}' in state_ranks_df.columns]]
+
+    # Every partition has rows of every recomputed bucket, so all of them are rewritten
+    long_df = state_ranks_df.reset_index()
+    if settings['partition_by'] == 'state':
+        for st, st_df in long_df.groupby('st_abb'):
+            write_partition(st_df.drop(columns=['st_abb']), out_dir / f'st_abb={st}')
+    else:
+        for initial, initial_df in long_df.groupby(long_df['names'].str[0]):
+            write_partition(initial_df, out_dir / f'initial={initial}')
+
+    settings['year_range'] = [year_range.start, year_range.stop, year_range.step]
+    if files_path is not None:
+        manifest['sources'] = source_signature(list_name_files(files_path))
+    with (out_dir / BUILD_MANIFEST).open("w") as f_h:
+        json.dump(manifest, f_h)
+    return [f'{yr}' for yr in buckets]
@@ -1,113 +1,52 @@
 # Import required libraries
-import pandas as pd
+import os
+import numpy as np
 from pathlib import Path
-from dash import Dash, html, dcc, Input, Output, State
+from dash import Dash, html, dcc, Input, Output, State, no_update
 from dash.exceptions import PreventUpdate
-import plotly.express as px
+from flask import jsonify
 import plotly.graph_objects as go
+from name_data import load_name_store, memory_report, national_cube_file, source_tag
+from name_rank import NameCube
+from name_cache import ResultCache, result_key
+from name_jobs import RankJobs
+from name_stats import GROUP_STATS, group_names, rank_table_stats
+from name_search import NameSearchIndex
+from name_figures import gen_name_rank_figure
+from name_metrics import count_rows, instrumented_callback, metrics, timed
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 
+# NAMESURFER_NAMES_PATH overrides the directory with the state files, e.g. for the benchmarks
+NAMES_FILES_PATH = Path(os.environ.get('NAMESURFER_NAMES_PATH', 'E:/UserLo/source/repos/learning/Name Surfer/NamesByState'))
 
-def load_name_files():
-    """
-    Read the names data into pandas dataframe
-    Create an empty DataFrame since the files don't have headers
-    """
-    names_df = pd.DataFrame(
-        columns=['State', 'Sex', 'Year', 'Name', 'NumOccurrences'])
-
-    files_path = Path(
-        'E:/UserLo/source/repos/learning/Name Surfer/NamesByState')
-    files_list = list(files_path.glob('*.txt'))
-    for f in files_list:
-        with f.open("r") as f_h:
-            state_df = pd.read_csv(f_h, header=None, names=[
-                                   'State', 'Sex', 'Year', 'Name', 'NumOccurrences'])
-            names_df = pd.concat([names_df, state_df], axis=0, copy=False)
-
-    names_df = names_df.astype({'Year': 'int32', 'NumOccurrences': 'int32'})
-    return names_df
-
-
-# Functions used to create name rank history DataFrame
-def compute_name_occurences(df, states, sexes, years):
-    """ df is the names DataFrame that has columns 
-    ['State', 'Sex', 'Year', 'Name', 'NumOccurrences'], Year and NumOccurrences are int32
-    states, sexes and years can be list, range, or set
-    Note:
-    Between 10% and 20% Male and Female names are the same so be aware when using both sexes
-    """
-    distinct_names = df[(df['State'].isin(states)) & (
-        df['Sex'].isin(sexes)) & (df['Year'].isin(years))]['Name'].unique()
+# Threads used to parse the state files when the columnar store has to be (re)built. None uses one per CPU
+NAMES_LOAD_WORKERS = None
 
-    name_occurrences_df = df[(df['State'].isin(states)) & (df['Sex'].isin(sexes)) & (df['Year'].isin(years)) &
-                             (df['Name'].isin(distinct_names))].groupby(by=['Name']).sum()
-    name_occurrences_df = name_occurrences_df.sort_values(
-        'NumOccurrences', ascending=False).reset_index()
+# Memory budget for cached rank DataFrames. Set NAMESURFER_RESULT_CACHE_DIR to a local directory
+# to also share the cached results between worker processes (e.g. gunicorn workers).
+# The directory is pruned, least recently used first, above NAMESURFER_RESULT_CACHE_DISK_BYTES (default 2 GiB)
+RESULT_CACHE_MAX_BYTES = 256 * 2**20
+RESULT_CACHE_DIR = os.environ.get('NAMESURFER_RESULT_CACHE_DIR')
+RESULT_CACHE_MAX_DISK_BYTES = int(os.environ.get('NAMESURFER_RESULT_CACHE_DISK_BYTES', 2 * 2**30))
 
-    return name_occurrences_df[['Name', 'NumOccurrences']]
+# Processes computing the rank tables for Apply Filters in the background, so the callbacks don't block.
+# Each one builds its own NameCube the first time it is used
+RANK_JOB_WORKERS = 2
+# How often the page asks for the progress of its rank job, in milliseconds
+RANK_JOB_POLL_MS = 500
 
 
-def compute_for_year_ranges(df, year_range, states, sexes):
+def load_name_files(files_path=NAMES_FILES_PATH, workers=NAMES_LOAD_WORKERS):
     """
-    All the names with the same count will get the same rank. There are many names that have same count.
-    df is the names DataFrame that has columns 
-    ['State', 'Sex', 'Year', 'Name', 'NumOccurrences'], Year and NumOccurrences are int32
-
-    year_range must be a range object 
+    Read the names data into pandas dataframe
+    The first start parses the .txt files, workers files at a time, and writes a columnar store next to them (see name_data.py).
+    Later starts memory map the store. It is rebuilt when a source file's mtime or size changes.
+    State, Sex and Name are categoricals, Year is int16 and NumOccurrences is int32
     """
-    # name_rank_year_ranges_df has index of all names. Columns = [Rank_<Year_range_1>,Rank_<Year_range_2>, Rank_<Year_range_3>, ...]
-    name_rank_year_ranges_df = pd.DataFrame()   # Empty df to hold accumulated ranks
-
-    if states == ['All']:
-        states = df['State'].unique()  # All the states in the input DataFrame
-
-    # TODO: if year_range == 'All' then set range(1900,2020)
-
-    for yr in year_range:
-        # Each value of yr will be the start year of the sub_year_range.
-        # yr+yr.step will be the stop year of the sub_year_range.
-        # sub_year_range will have a step size of 1
-        sub_year_range = range(yr, yr+year_range.step, 1)
-
-        # Find number of occurrences for a given name
-        name_occurrences_df = compute_name_occurences(
-            df, states, sexes, sub_year_range)
-        count_num_occ = name_occurrences_df.groupby('NumOccurrences').count(
-        ).sort_values('NumOccurrences', ascending=False).reset_index()
-
-        # Compute rank for a given NumOccurrences. Then match name to number of occurrences
-        # It makes sense to iterate using iterrows since the current_rank keeps accumulating
-        # ['NumOccurrences','NumNames','Rank']
-        # NumNames is the number of Names that have number of occurrences equal to NumOccurrences
-        all_ranks_list = []
-        current_rank = 1
-        for idx, r in count_num_occ.iterrows():
-            if idx != 0:
-                current_rank += count_num_occ.loc[idx-1, 'Name']
-
-            all_ranks_list.append(
-                [r['NumOccurrences'], r['Name'], current_rank])
-        all_ranks_df = pd.DataFrame(all_ranks_list, columns=[
-                                    'NumOccurrences', 'NumNames', f'{yr}'])
-
-        # merge performs a database join of the type specified by how=
-        # Set Name as the index to make it easier to get the rank using .loc
-        # nameRank_df has index of all the names. Columns = [NumOccurrences,	NumNames,	Rank]
-        nameRank_df = name_occurrences_df.merge(
-            all_ranks_df, on='NumOccurrences', how='inner').set_index('Name')
-        # Get just the Rank and merge it with name_rank_year_ranges_df
-        merged_e_df = name_rank_year_ranges_df.merge(
-            nameRank_df[[f'{yr}']], left_index=True, right_index=True, how='outer')
-
-         # Don't replace NaN with 0. Plotly handles nan, by just skipping those values which is what we want.
-        # merged_e_df.fillna(value=0, inplace=True)
-        name_rank_year_ranges_df = merged_e_df
-
-    return name_rank_year_ranges_df
+    return load_name_store(files_path, workers=workers)
 
 
 # multi select for state, sex. Input box for Start, Stop, Step year. Do validation.
@@ -126,11 +65,73 @@ state_dict = dict(list(zip(all_state_names_list,all_state_abbrevations_list)))
 
 # Read the data files
 names_df = load_name_files()
+# Aggregate cube so filter changes slice arrays instead of scanning names_df.
+# Its rows are the memory mapped store columns and its national array is memory mapped from the store,
+# so worker processes share them instead of each holding a copy (see /memory)
+names_cube = NameCube(names_df, national_file=national_cube_file(NAMES_FILES_PATH))
+# Prefix and typo search over all the names, most popular nationally first, for the name suggestions
+name_search = NameSearchIndex(names_cube.name_categories, names_cube.national.sum(axis=(0, 1), dtype=np.int64))
+# Rank DataFrames already computed for a filter selection
+# The disk tier is namespaced by the source files, so a data update (e.g. update_names_year.py) isn't hidden by old results
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DIR, max_disk_bytes=RESULT_CACHE_MAX_DISK_BYTES,
+                           namespace=source_tag(NAMES_FILES_PATH))
+
+
+@timed(rows=count_rows)
+def get_rank_table(key):
+    """
+    Return the rank DataFrame for a result_key. The key holds the whole filter selection,
+    so if the entry was evicted (or was computed by another worker) it is recomputed here.
+    """
+    sexes, states, start_year, end_year, year_step = key
+    return result_cache.get_or_compute(
+        key, lambda: names_cube.rank_year_ranges(range(start_year, end_year, year_step), list(states), list(sexes)))
+
+
+# Rank tables being computed for Apply Filters. Finished tables go to result_cache
+rank_jobs = RankJobs(NAMES_FILES_PATH, result_cache, RANK_JOB_WORKERS)
+
+
+@timed(rows=count_rows)
+def get_rank_stats(key):
+    """
+    Return the name groups (Most Variance, Top 50 New Names, ...) of the rank table for a result_key.
+    They are computed once per rank table with name_stats.rank_table_stats and cached next to it
+    """
+    return result_cache.get_or_compute(key + ('stats',), lambda: rank_table_stats(get_rank_table(key)))
+
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    """
+    Hit and miss counters of result_cache, used to size RESULT_CACHE_MAX_BYTES
+    """
+    return jsonify(result_cache.stats())
+
+
+@app.server.route('/memory')
+def memory_stats():
+    """
+    Bytes per row of names_df and how much of names_df and names_cube is private to this process
+    """
+    return jsonify(memory_report(names_df, names_cube))
+
+
+@app.server.route('/metrics')
+def metrics_snapshot():
+    """
+    Per stage timings and the recent callbacks, recorded when NAMESURFER_METRICS=1 (see name_metrics.py)
+    """
+    return jsonify(metrics.snapshot())
+
 
 # Create an app layout
 app.layout = html.Div(children=[
-    # dcc.Store stores all the name ranks
+    # dcc.Store stores the result_cache key of the name ranks. The rank DataFrame stays on the server
     dcc.Store(id='name-ranks'),
+    # The key of the rank job started by Apply Filters, polled by rank-job-poll until the table is ready
+    dcc.Store(id='rank-job'),
+    dcc.Interval(id='rank-job-poll', interval=RANK_JOB_POLL_MS, disabled=True),
 
     html.H1('Name Surfer Dashboard'),
            # style={'textAlign': 'center', 'color': '#503D36',
@@ -186,22 +187,25 @@ app.layout = html.Div(children=[
         # Refresh button after entering filter values
         # After button is clicked, read state of other components
         "After entering selection values, click to apply filters  ",
-        html.Button('Apply Filters', id='apply-filters', n_clicks=0, className='button-primary')
+        html.Button('Apply Filters', id='apply-filters', n_clicks=0, className='button-primary'),
+        html.Span(id='apply-progress', style={'padding': 10})
     ] , style={'padding': 10, 'flex': 1}),
 
     html.Div(children=[
         # Check boxes of interesting names
         html.Label(
             'Select some interesting name groups'),
-        dcc.Checklist(['Top 50 New Names', 'Most Variance', 'Presidents','First Ladies', 'The Beatles'],
+        dcc.Checklist(list(GROUP_STATS) + ['Presidents','First Ladies', 'The Beatles'],
                       ['The Beatles'],
                       id='interesting-names'),
         # Enter your own list of names. They will be added to the interesting names.
         html.Br(),
         html.Label(
             'Enter First Names Separated by Commas'),
+        # The browser shows the suggestions for the name being typed from the datalist
         dcc.Input(placeholder='Enter Names...',
-                  value='John,Paul,George,Ringo', type='text', id='csv-names'),
+                  value='John,Paul,George,Ringo', type='text', id='csv-names', list='csv-names-suggestions'),
+        html.Datalist(id='csv-names-suggestions'),
 
     ], style={'padding': 10, 'flex': 1}),
 
@@ -256,8 +260,37 @@ TheFirstLadies = ['Jill','Abigail','Louisa','Ellen','Barbara','Laura','Rosalynn'
 'Jacqueline','Mary','Dolley','Ida','Elizabeth','Pat','Michelle','Jane','Sarah','Nancy','Edith','Eleanor',
 'Helen','Margaret','Bess','Melania','Julia','Letitia','Hannah','Martha','Edith','Ellen']
 
+@app.callback(
+    Output(component_id='csv-names-suggestions', component_property='children'),
+    Input(component_id='csv-names', component_property='value')
+)
+@instrumented_callback()
+def suggest_csv_names(csv_names):
+    """
+    Typeahead for the last name in the comma separated list. Each option is the whole list with that name completed
+    """
+    if not csv_names:
+        return []
+    head, _, last = csv_names.rpartition(',')
+    head = head + ',' if head else ''
+    return [html.Option(value=head + name) for name in name_search.suggest(last)]
+
+
+def missing_name_item(name, result_df):
+    """
+    Text for a name with no data, with the close names that do have data
+    """
+    did_you_mean = [n for n in name_search.did_you_mean(name) if n in result_df.index][:3]
+    if len(did_you_mean) == 0:
+        return name
+    return f'{name} (did you mean {", ".join(did_you_mean)}?)'
+
 # ['Top 50 New Names', 'Most Variance', 'Presidents','First Ladies', 'The Beatles']
-def create_name_superset(n_set,interesting_names, result_df):
+def create_name_superset(n_set,interesting_names, stats_df):
+    """
+    Names of the selected interesting name groups plus n_set.
+    The computed groups (see name_stats.GROUP_STATS) are looked up in stats_df
+    """
     super_set = set()
     for group in interesting_names:
         if group == 'The Beatles':
@@ -266,23 +299,8 @@ def create_name_superset(n_set,interesting_names, result_df):
             super_set |= set(ThePresidents)
         elif group == 'First Ladies':
             super_set |= set(TheFirstLadies)
-        elif group == 'Most Variance':
-            # Names with the greatest variance in rank over years
-            # Exclude any names that dissappear, i.e. rank = NaN
-            var_result_series = result_df[(result_df>=0).all(axis=1)].var(axis=1)
-            var_result_top10_list = list(var_result_series.sort_values(ascending=False).head(10).index)
-            super_set |= set(var_result_top10_list)
-        elif group == 'Top 50 New Names':
-            start_year = result_df.columns[0]
-            end_year = result_df.columns[-1]
-            series_start = result_df.loc[:,start_year]
-            start_set=set(series_start[series_start>0].index)
-            series_end = result_df.loc[:,end_year]
-            end_set=set(series_end[series_end>0].index)
-            new_name_list = list(end_set - start_set)
-            # Sort ascending since lower values means higher rank
-            top_50_new_names = list(result_df.loc[new_name_list].sort_values(by=end_year,ascending=True).head(50).index) 
-            super_set |= set(top_50_new_names)
+        elif group in GROUP_STATS:
+            super_set |= set(group_names(stats_df, group))
 
     return super_set | n_set
 
@@ -313,28 +331,67 @@ def create_name_superset(n_set,interesting_names, result_df):
 # Use State to get the value of a component such as a text box, otherwise each individual character causes a callback
 # State('input-on-submit', 'value')
 # https://dash.plotly.com/dash-html-components/button
+def filter_key(sex,states,start_year, end_year,year_step):
+    """
+    result_key of the filter selection from the page
+    """
+    sex_1_char = [e[0] for e in sex]
+    # The SSA data set uses 2-char state abbreviations, so look up abbreviation in state_dict
+    state_abb_list = []
+    for i in states:
+        state_abb_list.append(state_dict[i])
+    return result_key(sex_1_char, state_abb_list, start_year, end_year, year_step)
+
+
 @app.callback(
-    Output(component_id='name-ranks', component_property='data'),
+    Output(component_id='rank-job', component_property='data'),
+    Output(component_id='rank-job-poll', component_property='disabled'),
     State(component_id='sex',component_property='value'),
     State(component_id='states',component_property='value'),
     State(component_id='start-year',component_property='value'),
     State(component_id='end-year',component_property='value'),
     State(component_id='year-step',component_property='value'),
+    State(component_id='rank-job', component_property='data'),
     Input(component_id='apply-filters', component_property='n_clicks'), prevent_initial_call=True
 )
-def store_result_df(sex,states,start_year, end_year,year_step, n_clicks):
+@instrumented_callback()
+def store_result_df(sex,states,start_year, end_year,year_step, rank_job, n_clicks):
    if n_clicks is None:
        raise PreventUpdate
    else:
-       # Call compute_for_year_ranges. Store the result df in JSON. When names change, read JSON an graph.
-       yr_range = range(int(start_year),int(end_year), int(year_step))
-       sex_1_char = [e[0] for e in sex]
-       # The SSA data set uses 2-char state abbreviations, so look up abbreviation in state_dict
-       state_abb_list = []
-       for i in states:
-            state_abb_list.append(state_dict[i])
-       result_df = compute_for_year_ranges(names_df,yr_range,state_abb_list, sex_1_char)
-       return result_df.to_json(date_format='iso', orient='split')
+       # Start computing the result df (same as compute_for_year_ranges) in the background, it ends up in
+       # result_cache. A click with the same filters joins the running job, other filters cancel it.
+       # Only the key goes to the browser. When names change, look up the key and graph just the selected rows.
+       key = filter_key(sex, states, start_year, end_year, year_step)
+       # The stored key comes back from the browser as JSON lists, result_key makes it a tuple key again
+       rank_jobs.submit(key, previous_key=result_key(*rank_job['key']) if rank_job else None)
+       return {'key': key}, False
+
+
+@app.callback(
+    Output(component_id='name-ranks', component_property='data'),
+    Output(component_id='apply-progress', component_property='children'),
+    Output(component_id='rank-job-poll', component_property='disabled', allow_duplicate=True),
+    Input(component_id='rank-job-poll', component_property='n_intervals'),
+    Input(component_id='rank-job', component_property='data'), prevent_initial_call=True
+)
+@instrumented_callback()
+def poll_rank_job(n_intervals, rank_job):
+    if rank_job is None:
+        raise PreventUpdate
+    key = result_key(*rank_job['key'])
+    state, done, total = rank_jobs.poll(key)
+    if state == 'done':
+        # The name groups don't depend on the names typed in, so compute them now instead of on every Refresh
+        get_rank_stats(key)
+        return {'key': key}, 'Filters applied, click Refresh', True
+    if state == 'missing':
+        # Evicted from result_cache (or cancelled by another page) before we got it
+        rank_jobs.submit(key)
+        return no_update, 'Ranking...', False
+    if state == 'failed':
+        return no_update, 'Ranking failed, click Apply Filters to try again', True
+    return no_update, f'Ranking year buckets {done}/{total}...', False
 
 
 @app.callback(
@@ -347,34 +404,28 @@ def store_result_df(sex,states,start_year, end_year,year_step, n_clicks):
     State(component_id='interesting-names', component_property='value'),
     Input(component_id='refresh-val', component_property='n_clicks'), prevent_initial_call=True
 )
-def plot_name_ranks(name_ranks_json, csv_names,interesting_names,n_clicks):
-    if name_ranks_json == None:
+@instrumented_callback()
+def plot_name_ranks(name_ranks, csv_names,interesting_names,n_clicks):
+    if name_ranks == None:
         raise PreventUpdate
     else:
-        result_df = pd.read_json(name_ranks_json, orient='split')
-        name_list = [e.strip() for e in csv_names.split(sep=',')] # strip whitespace
+        # The store has the key as a JSON list, result_key turns it back into the tuple
+        key = result_key(*name_ranks['key'])
+        result_df = get_rank_table(key)
+        # strip whitespace and fix the case of names typed e.g. in lower case
+        name_list = [name_search.match(e) or e.strip() for e in csv_names.split(sep=',')]
         n_set = set(name_list)
         # Create a superset of interesting names plus manually added names
-        name_superset = create_name_superset(n_set,interesting_names, result_df)
+        name_superset = create_name_superset(n_set,interesting_names, get_rank_stats(key))
 
         # Check the name_list to see which ones we have data on and which ones we don't
-        set_r = set(result_df.index)
-        clean = list(name_superset & set_r)
-        missing = list(name_superset - set_r)
+        clean = [n for n in name_superset if n in result_df.index]
+        missing = [n for n in name_superset if n not in result_df.index]
         if  (len(missing) > 0) and (missing[0]==''):
             missing.pop(0) # When all values are removed from text box, an empty string is returned so ignore it.
 
         if len(clean) > 0:
-            result_df_t = result_df.loc[clean, :].T
-
-            fig = px.line(result_df_t,x=result_df_t.index, y=result_df_t.columns) 
-            fig.update_traces(mode='lines+markers')
-            fig.update_yaxes(range=(result_df_t.max().max() + 1,.9))
-            #  fig.update_yaxes(type='linear' if axis_type == 'Linear' else 'log')
-            fig.update_xaxes(title_text="Years")
-            fig.update_yaxes(title_text="Rank")
-            fig.update_layout (legend_title_text='Names') 
-            fig.update_layout (legend_title_font={'family':'Arial Black'}) 
+            fig = gen_name_rank_figure(result_df, clean)
         else: 
             fig = go.Figure() #empty figure
 
@@ -382,7 +433,7 @@ def plot_name_ranks(name_ranks_json, csv_names,interesting_names,n_clicks):
             return fig,\
                 {'width': '80%', 'display': 'inline-block', 'padding': '0 20'},\
                 {'display': 'inline-block', 'width': '15%', 'float':'right'},\
-                create_list_items(missing)
+                create_list_items([missing_name_item(n, result_df) for n in missing])
         else:
             return fig,\
                 {'width': '100%', 'display': 'inline-block', 'padding': '0 20'},\
@@ -0,0 +1,408 @@
+# Load the SSA names by state files and keep a columnar binary copy of them
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:    # Windows, the store is then written without a lock
+    fcntl = None
+
+NAME_COLUMNS = ['State', 'Sex', 'Year', 'Name', 'NumOccurrences']
+
+# The store lives next to the source files unless another directory is given
+STORE_DIR_NAME = '.names_store'
+STORE_VERSION = 1
+# Derived from the store columns (see name_rank.NameCube), deleted whenever the store is written
+NATIONAL_CUBE_FILE = 'national_cube.npy'
+# Held while the store is written, so processes starting together build it once
+STORE_LOCK_FILE = '.lock'
+
+
+def list_name_files(files_path):
+    """
+    Return the .txt files in files_path, sorted by file name.
+    The match is case insensitive since the SSA zip has upper case .TXT extensions
+    """
+    files_path = Path(files_path)
+    return sorted(f for f in files_path.iterdir()
+                  if f.is_file() and f.suffix.lower() == '.txt')
+
+
+def source_signature(files_list):
+    """
+    Return {file name: [mtime_ns, size]} for the source files.
+    The store is rebuilt whenever this doesn't match the one saved with it.
+    """
+    signature = {}
+    for f in files_list:
+        st = f.stat()
+        signature[f.name] = [st.st_mtime_ns, st.st_size]
+    return signature
+
+
+def read_name_file(f):
+    """
+    Read one state file. The files don't have headers
+    """
+    with f.open("r") as f_h:
+        return pd.read_csv(f_h, header=None, names=NAME_COLUMNS,
+                           dtype={'State': str, 'Sex': str, 'Year': 'int16',
+                                  'Name': str, 'NumOccurrences': 'int32'})
+
+
+# SSA national files are yobYYYY.txt with rows Name,Sex,NumOccurrences
+NATIONAL_FILE_PATTERN = re.compile(r'yob(\d{4})\.txt$', re.IGNORECASE)
+NATIONAL_STATE = 'US'
+# Rows per chunk when streaming the source files
+CHUNK_ROWS = 500_000
+
+
+def stream_name_chunks(files_list, chunksize=CHUNK_ROWS):
+    """
+    Yield DataFrames of at most chunksize rows with the columns of NAME_COLUMNS, one file after the other.
+    State files are read as is. National yobYYYY.txt files get State 'US' and the Year from the file name.
+    Only one chunk is in memory at a time.
+    """
+    for f in files_list:
+        national = NATIONAL_FILE_PATTERN.search(f.name)
+        with f.open("r") as f_h:
+            if national is None:
+                reader = pd.read_csv(f_h, header=None, names=NAME_COLUMNS, chunksize=chunksize,
+                                     dtype={'State': str, 'Sex': str, 'Year': 'int16',
+                                            'Name': str, 'NumOccurrences': 'int32'})
+                yield from reader
+            else:
+                reader = pd.read_csv(f_h, header=None, names=['Name', 'Sex', 'NumOccurrences'], chunksize=chunksize,
+                                     dtype={'Name': str, 'Sex': str, 'NumOccurrences': 'int32'})
+                for chunk in reader:
+                    chunk['State'] = NATIONAL_STATE
+                    chunk['Year'] = np.int16(national.group(1))
+                    yield chunk[NAME_COLUMNS]
+
+
+def default_workers():
+    """
+    One worker per CPU, at most 32
+    """
+    return min(32, os.cpu_count() or 1)
+
+
+def read_name_files(files_list, workers=1, use_processes=False):
+    """
+    Read all the state files and concatenate them once at the end, in the order of files_list.
+    Returns the raw DataFrame with object string columns.
+
+    With workers > 1 the files are parsed concurrently. Threads are the default since the CSV tokenizer
+    runs without the GIL and they are safe to start while a module is being imported (the apps load at import).
+    use_processes=True parses on a process pool instead, which scales better but on platforms that spawn
+    processes (Windows, macOS) the caller's module must guard its top level code with if __name__ == '__main__'.
+    """
+    if workers > 1 and len(files_list) > 1:
+        pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_class(max_workers=min(workers, len(files_list))) as pool:
+            # map returns the results in the order of files_list, whichever file finishes first
+            state_dfs = list(pool.map(read_name_file, files_list))
+    else:
+        state_dfs = [read_name_file(f) for f in files_list]
+    if len(state_dfs) == 0:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in
+                             zip(NAME_COLUMNS, [str, str, 'int16', str, 'int32'])})
+    return pd.concat(state_dfs, axis=0, ignore_index=True)
+
+
+def encode_names_df(names_df):
+    """
+    Dictionary encode State, Sex and Name as categoricals with sorted categories.
+    Year is int16 and NumOccurrences is int32.
+    """
+    return pd.DataFrame({
+        'State': pd.Categorical(names_df['State']),
+        'Sex': pd.Categorical(names_df['Sex']),
+        'Year': names_df['Year'].to_numpy(dtype=np.int16),
+        'Name': pd.Categorical(names_df['Name']),
+        'NumOccurrences': names_df['NumOccurrences'].to_numpy(dtype=np.int32),
+    })
+
+
+@contextmanager
+def store_lock(store_dir):
+    """
+    Hold an exclusive lock on the store directory for the with block.
+    Every process that writes the store takes it, readers don't need it since the manifest is written last
+    """
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with (store_dir / STORE_LOCK_FILE).open("a") as f_h:
+        fcntl.flock(f_h, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f_h, fcntl.LOCK_UN)
+
+
+def write_name_store(names_df, store_dir, signature):
+    """
+    Write the encoded DataFrame as one .npy file per column plus a manifest.json.
+    The manifest holds the categories of the encoded columns and the source signature.
+    It is written last so a partially written store is never seen as valid.
+    Call it with store_lock held when other processes may write the same store.
+    """
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    manifest_file = store_dir / 'manifest.json'
+    for stale_file in [manifest_file, store_dir / NATIONAL_CUBE_FILE]:
+        if stale_file.exists():
+            stale_file.unlink()
+
+    categories = {}
+    for col in NAME_COLUMNS:
+        series = names_df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories[col] = list(series.cat.categories)
+            values = series.cat.codes.to_numpy()
+        else:
+            values = series.to_numpy()
+        # Replace the file instead of overwriting it, a running process may have the old one memory mapped
+        tmp_file = store_dir / f'{col}.{os.getpid()}.{threading.get_ident()}.tmp.npy'
+        np.save(tmp_file, values, allow_pickle=False)
+        os.replace(tmp_file, store_dir / f'{col}.npy')
+
+    manifest = {'version': STORE_VERSION,
+                'num_rows': len(names_df),
+                'categories': categories,
+                'sources': signature}
+    with manifest_file.open("w") as f_h:
+        json.dump(manifest, f_h)
+
+
+def read_store_manifest(store_dir):
+    """
+    Return the manifest of a store written by write_name_store, None if it is missing or from an older version
+    """
+    manifest_file = Path(store_dir) / 'manifest.json'
+    if not manifest_file.exists():
+        return None
+    try:
+        with manifest_file.open("r") as f_h:
+            manifest = json.load(f_h)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != STORE_VERSION:
+        return None
+    return manifest
+
+
+def read_name_store(store_dir, signature=None, mmap=True):
+    """
+    Read a store written by write_name_store.
+    Return None if the store is missing, from an older version, doesn't match signature
+    or is being rewritten (a column doesn't have the rows of the manifest).
+    With mmap=True the plain numeric columns are memory mapped instead of read.
+    """
+    store_dir = Path(store_dir)
+    manifest = read_store_manifest(store_dir)
+    if manifest is None:
+        return None
+    if signature is not None and manifest.get('sources') != signature:
+        return None
+
+    columns = {}
+    for col in NAME_COLUMNS:
+        col_file = store_dir / f'{col}.npy'
+        if not col_file.exists():
+            return None
+        try:
+            values = np.load(col_file, mmap_mode='r' if mmap else None, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        if len(values) != manifest['num_rows']:
+            return None
+        if col in manifest['categories']:
+            columns[col] = pd.Categorical.from_codes(
+                values, categories=manifest['categories'][col])
+        else:
+            columns[col] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_name_store(files_path, store_dir=None, mmap=True, workers=None, use_processes=False):
+    """
+    Return the encoded names DataFrame for the state files in files_path.
+    The first call parses the .txt files and writes the store. Later calls read the store,
+    unless a source file was added, removed or its mtime or size changed.
+    The rebuild holds store_lock, so when several processes start without a store one of them builds it
+    and the others read what it wrote.
+    workers and use_processes are passed to read_name_files, workers=None uses one per CPU.
+    """
+    if workers is None:
+        workers = default_workers()
+    files_path = Path(files_path)
+    if store_dir is None:
+        store_dir = files_path / STORE_DIR_NAME
+    files_list = list_name_files(files_path)
+    signature = source_signature(files_list)
+
+    names_df = read_name_store(store_dir, signature, mmap=mmap)
+    if names_df is None:
+        with store_lock(store_dir):
+            # Another process may have built it while this one waited for the lock
+            names_df = read_name_store(store_dir, signature, mmap=mmap)
+            if names_df is None:
+                names_df = encode_names_df(read_name_files(files_list, workers, use_processes))
+                write_name_store(names_df, store_dir, signature)
+    return names_df
+
+
+def national_cube_file(files_path, store_dir=None):
+    """
+    Where name_rank.NameCube keeps its national array for the store of files_path
+    """
+    if store_dir is None:
+        store_dir = Path(files_path) / STORE_DIR_NAME
+    return Path(store_dir) / NATIONAL_CUBE_FILE
+
+
+def is_memory_mapped(values):
+    """
+    True if the array is a view of a memory mapped file. Those pages are shared by every process mapping the file
+    """
+    while values is not None:
+        if isinstance(values, (np.memmap, mmap.mmap)):
+            return True
+        values = getattr(values, 'base', None)
+    return False
+
+
+def process_memory():
+    """
+    Resident memory of this process in bytes: rss, and private (anonymous) memory that isn't shared
+    with other workers. Read from /proc, so only on Linux. Empty dict elsewhere
+    """
+    try:
+        with open('/proc/self/status') as f_h:
+            status = dict(line.split(':', 1) for line in f_h if ':' in line)
+    except OSError:
+        return {}
+    return {'rss_bytes': int(status['VmRSS'].split()[0]) * 1024,
+            'private_bytes': int(status['RssAnon'].split()[0]) * 1024}
+
+
+def memory_report(names_df, names_cube=None):
+    """
+    Memory used by the names DataFrame (and a NameCube built from it), split into private memory
+    and memory mapped from the store, plus bytes per row of the table
+    """
+    def arrays_report(arrays):
+        private = sum(a.nbytes for a in arrays if not is_memory_mapped(a))
+        mapped = sum(a.nbytes for a in arrays if is_memory_mapped(a))
+        return {'bytes': private + mapped, 'private_bytes': private, 'mapped_bytes': mapped}
+
+    arrays = []
+    categories_bytes = 0
+    for col in names_df.columns:
+        if isinstance(names_df[col].dtype, pd.CategoricalDtype):
+            arrays.append(names_df[col].array.codes)
+            categories_bytes += int(names_df[col].cat.categories.memory_usage(deep=True))
+        else:
+            arrays.append(names_df[col].to_numpy())
+    table = arrays_report(arrays)
+    table['categories_bytes'] = categories_bytes
+    num_rows = len(names_df)
+    report = {'rows': num_rows,
+              'bytes_per_row': table['bytes'] / num_rows if num_rows else 0.0,
+              'table': table}
+    if names_cube is not None:
+        # Arrays the cube shares with names_df are counted in both
+        report['cube'] = arrays_report([a for a in vars(names_cube).values() if isinstance(a, np.ndarray)])
+    report['process'] = process_memory()
+    return report
+
+
+def source_tag(files_path):
+    """
+    Short hash of the source files' signature. Changes whenever the data changes,
+    so it can tag results computed from the data (see name_cache.ResultCache)
+    """
+    signature = source_signature(list_name_files(files_path))
+    return hashlib.sha1(json.dumps(signature, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def extend_categorical(old, new_values):
+    """
+    Return (categories, codes of new_values) where categories are old's categories followed by the new values
+    not seen before, so the codes already stored for old stay valid
+    """
+    old_categories = old.cat.categories
+    added = pd.Index(pd.unique(np.asarray(new_values, dtype=object))).difference(old_categories).sort_values()
+    categories = old_categories.append(added)
+    return categories, pd.Categorical(new_values, categories=categories).codes
+
+
+def append_name_years(files_path, years, store_dir=None):
+    """
+    Update the store for newly published years without re-encoding the whole table.
+    Only the source files whose mtime or size changed since the store was written are parsed (streamed in chunks),
+    and their rows of years replace the rows of those states and years already in the store.
+    New names, states or sexes are appended to the categories.
+    The rows of the other years are assumed unchanged, so use load_name_store for a full rebuild
+    if SSA revised earlier years or a file was removed.
+    The whole store is still sorted and rewritten, so when every state file changed (a new SSA year)
+    this costs about as much as the full rebuild of load_name_store. Returns the updated names DataFrame
+    """
+    files_path = Path(files_path)
+    if store_dir is None:
+        store_dir = files_path / STORE_DIR_NAME
+    files_list = list_name_files(files_path)
+    signature = source_signature(files_list)
+
+    with store_lock(store_dir):
+        manifest = read_store_manifest(store_dir)
+        old_df = read_name_store(store_dir, mmap=True)
+        if old_df is None:
+            names_df = encode_names_df(read_name_files(files_list, default_workers()))
+            write_name_store(names_df, store_dir, signature)
+            return read_name_store(store_dir, signature)
+
+        old_sources = manifest['sources']
+        changed = [f for f in files_list if old_sources.get(f.name) != signature[f.name]]
+        if len(changed) == 0:
+            return old_df
+        # SSA names each file after its state (AK.TXT has the AK rows)
+        changed_states = {f.stem.upper() for f in changed}
+
+        years = set(years)
+        new_chunks = [chunk[chunk['Year'].isin(years)] for chunk in stream_name_chunks(changed)]
+        new_df = pd.concat(new_chunks, ignore_index=True)
+        replaced = old_df['Year'].isin(years).to_numpy() & old_df['State'].isin(changed_states).to_numpy()
+        old_df = old_df[~replaced]
+
+        columns = {}
+        for col in NAME_COLUMNS:
+            if isinstance(old_df[col].dtype, pd.CategoricalDtype):
+                categories, new_codes = extend_categorical(old_df[col], new_df[col])
+                codes = np.concatenate([old_df[col].cat.codes.to_numpy(), new_codes])
+                columns[col] = pd.Categorical.from_codes(codes, categories=categories)
+            else:
+                columns[col] = np.concatenate([old_df[col].to_numpy(),
+                                               new_df[col].to_numpy().astype(old_df[col].dtype)])
+        names_df = pd.DataFrame(columns)
+
+        # Keep the rows in (state, sex, year) order like the state files, NameCube relies on it to skip sorting
+        order = np.lexsort((names_df['Year'].to_numpy(), names_df['Sex'].cat.codes.to_numpy(),
+                            names_df['State'].cat.codes.to_numpy()))
+        names_df = names_df.iloc[order].reset_index(drop=True)
+        write_name_store(names_df, store_dir, signature)
+        return read_name_store(store_dir, signature)
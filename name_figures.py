@@ -0,0 +1,115 @@
+# Plotly figures of the name rank results, shared by the Dash apps and export_names.py
+import plotly.express as px
+import plotly.graph_objects as go
+
+from name_metrics import timed
+
+
+@timed()
+def gen_name_rank_figure(result_df, names):
+    """
+    Line chart of the rank of each name in names over the year buckets of result_df (Name x bucket rank table).
+    All the names must be in result_df
+    """
+    result_df_t = result_df.loc[names, :].T
+
+    fig = px.line(result_df_t,x=result_df_t.index, y=result_df_t.columns) 
+    fig.update_traces(mode='lines+markers')
+    fig.update_yaxes(range=(result_df_t.max().max() + 1,.9))
+    #  fig.update_yaxes(type='linear' if axis_type == 'Linear' else 'log')
+    fig.update_xaxes(title_text="Years")
+    fig.update_yaxes(title_text="Rank")
+    fig.update_layout (legend_title_text='Names') 
+    fig.update_layout (legend_title_font={'family':'Arial Black'}) 
+    return fig
+
+
+def gen_choropleth_trace(block, z):
+    """
+    Choropleth trace for the states in a NameBlock, colored by z
+    """
+    return go.Choropleth(
+        locations=block.locations, # Spatial coordinates
+        z = z, # Data to be color-coded
+
+        # The built-in Plotly geojson for USA is lower resolution, but much faster to render than states_geojson_clean_dict
+        # If you want to switch, comment out locationmode and uncomment geojson and featureidkey
+        locationmode = 'USA-states', # set of locations match entries in `locations`
+        #geojson=states_geojson_clean_dict, 
+        #featureidkey="properties.Abbreviation",
+
+        colorscale = 'Viridis',
+        reversescale=True,
+        zmin=block.color_min, zmax = block.color_max,
+        colorbar=dict(title='Name Popularity Rank',
+        )
+    )
+
+
+@timed()
+def gen_choropleth_for_name_year(name_index,name,year):
+    """
+    gen_choropleth_for_name_year
+    Using the NameIndex of the previously computed state names result DataFrame, generate a choropleth map of USA states showing the ranking by state.
+
+    Return:
+    Plotly Graph Objects Figure. The figure is empty if there is no data for name
+    """
+    if type(year)!=str:
+        year = f'{year:4.0f}'
+    # One lookup gives the states, the ranks for every year and the color bounds (capped at 500)
+    block = name_index.lookup(name)
+    if block is None:
+        return go.Figure() #empty figure
+    fig = go.Figure(data=gen_choropleth_trace(block, name_index.year_ranks(block, year)))
+
+    fig.update_layout(
+        geo_scope='usa', # limit map scope to USA
+        title_text = f'{year} Popularity Rank for {name} by State')
+
+    # fig.update_coloraxes(colorbar=dict(orientation='h'))
+
+
+    return fig
+
+
+@timed()
+def gen_choropleth_animation_for_name(name_index,name):
+    """
+    gen_choropleth_animation_for_name
+    Same map as gen_choropleth_for_name_year, but with one frame for every year in the result and a year slider
+    plus Play/Pause buttons in the figure. Moving the slider just switches frames in the browser,
+    so there are no callbacks while scrubbing.
+
+    Return:
+    Plotly Graph Objects Figure. The figure is empty if there is no data for name
+    """
+    block = name_index.lookup(name)
+    if block is None:
+        return go.Figure() #empty figure
+
+    years = block.years
+    # Frames only replace z and the title, the locations and color scale come from the first trace
+    frames = [go.Frame(name=year,
+                       data=[go.Choropleth(z=name_index.year_ranks(block, year))],
+                       traces=[0],
+                       layout=dict(title_text=f'{year} Popularity Rank for {name} by State'))
+              for year in years]
+    frame_args = dict(mode='immediate', frame=dict(duration=0, redraw=True), transition=dict(duration=0))
+
+    fig = go.Figure(data=gen_choropleth_trace(block, name_index.year_ranks(block, years[0])), frames=frames)
+    fig.update_layout(
+        geo_scope='usa', # limit map scope to USA
+        title_text = f'{years[0]} Popularity Rank for {name} by State',
+        sliders=[dict(active=0,
+                      currentvalue=dict(prefix='Year: '),
+                      pad=dict(t=30),
+                      steps=[dict(method='animate', label=year, args=[[year], frame_args]) for year in years])],
+        updatemenus=[dict(type='buttons', direction='left', x=0.1, y=0, xanchor='right', yanchor='top',
+                          pad=dict(t=40, r=10),
+                          buttons=[dict(label='Play', method='animate',
+                                        args=[None, dict(frame_args, frame=dict(duration=500, redraw=True),
+                                                         fromcurrent=True)]),
+                                   dict(label='Pause', method='animate', args=[[None], frame_args])])])
+
+    return fig
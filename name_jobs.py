@@ -0,0 +1,171 @@
+# Background rank computations for the Apply Filters button of name_dash_app.py
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from name_data import load_name_store, national_cube_file
+from name_metrics import record_stage
+from name_rank import NameCube, rank_table_from_totals
+
+# The pool is started from a request thread of the server, and forking a process that has threads can deadlock.
+# forkserver (or spawn where there is no forkserver) starts clean workers. The forkserver preloads the main module,
+# so with python name_dash_app.py it runs the whole app module once more (store, NameCube, search index, cache)
+# and the workers are forked from it. init_rank_worker still builds each worker's own NameCube.
+# Under gunicorn the main module is gunicorn's and none of the app runs in the forkserver
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# NameCube of the worker process, built once by init_rank_worker
+_worker_cube = None
+
+
+def init_rank_worker(names_path):
+    """
+    Process pool initializer. Every worker memory maps the names store and builds its own NameCube once.
+    The cube's big arrays are the memory mapped store files, shared with the app and the other workers
+    """
+    global _worker_cube
+    _worker_cube = NameCube(load_name_store(names_path, workers=1), national_file=national_cube_file(names_path))
+
+
+def rank_bucket(year_start, year_step, states, sexes):
+    """
+    Rank table with the single year bucket starting at year_start. Runs in a worker process
+    """
+    return _worker_cube.rank_year_ranges(range(year_start, year_start + year_step, year_step), states, sexes)
+
+
+class RankJob:
+    """
+    Rank table of one result_key computed on the pool, one task per year bucket so the
+    progress is the number of buckets done and a cancel drops the buckets not started yet.
+    subscribers counts the sessions waiting for it
+    """
+
+    def __init__(self, key, futures):
+        self.key = key
+        self.futures = futures
+        self.subscribers = 1
+        self.start = time.perf_counter()
+
+    def progress(self):
+        """
+        (buckets done, number of buckets)
+        """
+        return sum(f.done() for f in self.futures), len(self.futures)
+
+    def done(self):
+        return all(f.done() for f in self.futures)
+
+    def cancel(self):
+        for f in self.futures:
+            f.cancel()
+
+    def result(self):
+        """
+        The rank table, the same as NameCube.rank_year_ranges for the whole key. Raises the worker's exception if one failed
+        """
+        if len(self.futures) == 0:
+            # End year at or before the start year, no buckets. The empty table of NameCube.rank_year_ranges
+            empty = np.zeros((0, 0))
+            return rank_table_from_totals(empty, empty > 0, np.zeros(0, dtype=object), range(0))
+        parts = [f.result() for f in self.futures]
+        return pd.concat(parts, axis=1, sort=True).rename_axis('Name')
+
+
+class RankJobs:
+    """
+    Rank tables being computed in the background on a local process pool, by result_key.
+    A key already being computed isn't submitted twice, and a session that moves on to another key
+    cancels its previous job unless other sessions are still waiting for it.
+    Finished tables go to result_cache, which is where the app reads them from.
+    """
+
+    def __init__(self, names_path, result_cache, workers=2):
+        self.names_path = names_path
+        self.result_cache = result_cache
+        self.workers = workers
+        self._pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # Started on first use, so importing the app doesn't start processes
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_rank_worker,
+                                             initargs=(str(self.names_path),),
+                                             mp_context=multiprocessing.get_context(POOL_START_METHOD))
+        return self._pool
+
+    def submit(self, key, previous_key=None):
+        """
+        Start computing the rank table of key unless it is cached or already running.
+        previous_key is the key this session waited for before, its job is cancelled if nobody else needs it.
+        Both are result_key tuples, normalize a key that went through the browser with result_key(*key)
+        """
+        with self._lock:
+            if previous_key is not None and previous_key != key:
+                self._release(previous_key)
+            if key in self._jobs:
+                if previous_key != key:
+                    self._jobs[key].subscribers += 1
+                return
+            if self.result_cache.get(key) is not None:
+                return
+            sexes, states, start_year, end_year, year_step = key
+            pool = self._get_pool()
+            futures = [pool.submit(rank_bucket, yr, year_step, list(states), list(sexes))
+                       for yr in range(start_year, end_year, year_step)]
+            self._jobs[key] = RankJob(key, futures)
+
+    def _release(self, key):
+        job = self._jobs.get(key)
+        if job is None:
+            return
+        job.subscribers -= 1
+        if job.subscribers <= 0:
+            job.cancel()
+            del self._jobs[key]
+
+    def cancel(self, key):
+        """
+        Stop waiting for key. The job is cancelled if no other session waits for it
+        """
+        with self._lock:
+            self._release(key)
+
+    def poll(self, key):
+        """
+        Return (state, buckets done, number of buckets) for key, state is 'done', 'running', 'missing' or 'failed'.
+        The first poll after the job finishes moves the table into result_cache, with the lock held so another
+        session polling meanwhile finds either the job or the table. The job's wall time and rows are recorded
+        as the rank_job stage of name_metrics, the ranking itself runs in the workers where it isn't recorded.
+        'missing' means there is neither a job nor a cached table, e.g. the table was evicted, so submit again
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                return ('done', 1, 1) if self.result_cache.get(key) is not None else ('missing', 0, 0)
+            done, total = job.progress()
+            if done < total:
+                return 'running', done, total
+            try:
+                rank_df = job.result()
+                self.result_cache.put(key, rank_df)
+            except Exception:
+                return 'failed', done, total
+            finally:
+                del self._jobs[key]
+        record_stage('rank_job', time.perf_counter() - job.start, rows=len(rank_df))
+        return 'done', done, total
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel()
+            self._jobs.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,186 @@
+# Opt-in timing of the Dash callbacks and the compute functions they call
+# Set NAMESURFER_METRICS=1 to turn it on. Otherwise the decorators return the functions unchanged.
+#   NAMESURFER_METRICS_LOG             file for the JSON lines log of every callback (default stderr)
+#   NAMESURFER_PROFILE_SAMPLE_RATE     fraction of callbacks run under cProfile, e.g. 0.01 (default 0)
+#   NAMESURFER_PROFILE_DIR             directory for the .prof files (default profiles)
+# The apps serve the aggregated timings at /metrics
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+from plotly.io.json import to_json_plotly
+
+METRICS_ENABLED = os.environ.get('NAMESURFER_METRICS', '') not in ('', '0')
+METRICS_LOG = os.environ.get('NAMESURFER_METRICS_LOG')
+PROFILE_SAMPLE_RATE = float(os.environ.get('NAMESURFER_PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = Path(os.environ.get('NAMESURFER_PROFILE_DIR', 'profiles'))
+# Number of callback records kept for /metrics
+RECENT_REQUESTS = 50
+
+logger = logging.getLogger('namesurfer.metrics')
+if METRICS_ENABLED and not logger.handlers:
+    logger.addHandler(logging.FileHandler(METRICS_LOG) if METRICS_LOG else logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def count_rows(result):
+    """
+    Number of rows of a DataFrame (or anything with a length) result, None for anything else
+    """
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+class Metrics:
+    """
+    Totals per stage (count, seconds, rows, bytes) plus the last RECENT_REQUESTS callback records.
+    Shared by all the threads of the server
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+
+    def record(self, name, seconds, rows=None, nbytes=None):
+        with self._lock:
+            s = self.stages.setdefault(name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'rows': 0, 'bytes': 0})
+            s['count'] += 1
+            s['total_s'] += seconds
+            s['max_s'] = max(s['max_s'], seconds)
+            s['rows'] += rows or 0
+            s['bytes'] += nbytes or 0
+
+    def add_request(self, request):
+        with self._lock:
+            self.recent.append(request)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {name: dict(s, mean_s=s['total_s'] / s['count']) for name, s in self.stages.items()}
+            return {'enabled': METRICS_ENABLED, 'stages': stages, 'recent': list(self.recent)}
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.recent.clear()
+
+
+metrics = Metrics()
+# Stage records of the callback running on this thread, None outside a callback
+_request = threading.local()
+
+
+def _add_stage(name, seconds, rows=None, nbytes=None):
+    metrics.record(name, seconds, rows, nbytes)
+    stages = getattr(_request, 'stages', None)
+    if stages is not None:
+        entry = {'stage': name, 'seconds': round(seconds, 6)}
+        if rows is not None:
+            entry['rows'] = rows
+        if nbytes is not None:
+            entry['bytes'] = nbytes
+        stages.append(entry)
+
+
+def record_stage(name, seconds, rows=None, nbytes=None):
+    """
+    Record a stage timed elsewhere, e.g. work done in another process. Does nothing unless metrics are enabled
+    """
+    if METRICS_ENABLED:
+        _add_stage(name, seconds, rows, nbytes)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the with block as stage name. Does nothing unless metrics are enabled
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_stage(name, time.perf_counter() - start)
+
+
+def timed(name=None, rows=None):
+    """
+    Decorator that times every call as stage name (default the function's qualified name).
+    rows is a function of the result giving the row count to record, e.g. count_rows
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            _add_stage(stage_name, time.perf_counter() - start, rows(result) if rows else None)
+            return result
+        return wrapper
+    return decorator
+
+
+def instrumented_callback(name=None):
+    """
+    Decorator for a Dash callback (put it under @app.callback). Every call logs one JSON line with the
+    total time, the stages timed inside it and the size of the JSON that Dash sends back (encoding it
+    here once more is the json_encode stage). A PROFILE_SAMPLE_RATE fraction of the calls are run under
+    cProfile and dumped to PROFILE_DIR
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        callback_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            _request.stages = []
+            profiler = cProfile.Profile() if random.random() < PROFILE_SAMPLE_RATE else None
+            request = {'callback': callback_name, 'time': time.time()}
+            start = time.perf_counter()
+            try:
+                if profiler is not None:
+                    result = profiler.runcall(func, *args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+                encode_start = time.perf_counter()
+                payload_bytes = len(to_json_plotly(result))
+                _add_stage('json_encode', time.perf_counter() - encode_start, nbytes=payload_bytes)
+                request['payload_bytes'] = payload_bytes
+                return result
+            except Exception as e:
+                # PreventUpdate ends up here too, it isn't an error
+                request['exception'] = type(e).__name__
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                metrics.record(f'callback.{callback_name}', seconds, nbytes=request.get('payload_bytes'))
+                request['seconds'] = round(seconds, 6)
+                request['stages'] = _request.stages
+                _request.stages = None
+                if profiler is not None:
+                    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+                    profile_file = PROFILE_DIR / f'{callback_name}_{int(request["time"] * 1000)}.prof'
+                    profiler.dump_stats(profile_file)
+                    request['profile'] = str(profile_file)
+                metrics.add_request(request)
+                logger.info(json.dumps(request))
+        return wrapper
+    return decorator
@@ -0,0 +1,518 @@
+# Vectorized name rank computations on the names DataFrame
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from name_metrics import count_rows, timed
+
+
+def encode_column(series):
+    """
+    Return (codes, categories) for a column of the names DataFrame.
+    Categorical columns (see name_data.py) are used as is, other columns are factorized with sorted categories.
+    The codes of a categorical are not copied, so codes memory mapped from the names store stay shared.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # .cat.codes would return a copy
+        return series.array.codes, series.cat.categories
+    codes, categories = pd.factorize(series, sort=True)
+    return codes, categories
+
+
+def select_codes(categories, values):
+    """
+    Return a boolean lookup array over categories that is True for categories in values
+    """
+    return np.isin(np.asarray(categories, dtype=object), list(values))
+
+
+def year_bucket_codes(years, year_range):
+    """
+    Map each year to the index of its bucket in year_range.
+    Bucket i covers range(year_range[i], year_range[i]+year_range.step). Years outside all buckets get -1
+    """
+    years = np.asarray(years, dtype=np.int64)
+    bucket = (years - year_range.start) // year_range.step
+    outside = (years < year_range.start) | (bucket >= len(year_range))
+    return np.where(outside, -1, bucket)
+
+
+def competition_rank(bucket, totals):
+    """
+    Competition ("min") rank of totals within each bucket, largest total gets rank 1.
+    bucket and totals are parallel 1-d arrays. All buckets are ranked in one pass:
+    sort by (bucket, -total), then every entry gets the position of the first entry of its (bucket, total) run.
+    """
+    n = len(totals)
+    rank = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return rank
+    order = np.lexsort((-totals, bucket))
+    b_sorted = bucket[order]
+    t_sorted = totals[order]
+    pos = np.arange(n)
+
+    new_bucket = np.empty(n, dtype=bool)
+    new_bucket[0] = True
+    new_bucket[1:] = b_sorted[1:] != b_sorted[:-1]
+    new_run = new_bucket.copy()
+    new_run[1:] |= t_sorted[1:] != t_sorted[:-1]
+
+    bucket_first = np.maximum.accumulate(np.where(new_bucket, pos, 0))
+    run_first = np.maximum.accumulate(np.where(new_run, pos, 0))
+    rank[order] = run_first - bucket_first + 1
+    return rank
+
+
+def name_bucket_totals(df, year_range, states, sexes):
+    """
+    Sum NumOccurrences for every (year bucket, name) in one pass over df.
+    Return (totals, present, name_categories) where totals and present are (num buckets x num names) arrays.
+    present is True where the name has at least one row in the bucket.
+    """
+    name_codes, name_categories = encode_column(df['Name'])
+    state_codes, state_categories = encode_column(df['State'])
+    sex_codes, sex_categories = encode_column(df['Sex'])
+
+    bucket = year_bucket_codes(df['Year'].to_numpy(), year_range)
+    keep = (bucket >= 0) & select_codes(state_categories, states)[state_codes] & \
+        select_codes(sex_categories, sexes)[sex_codes]
+
+    num_names = len(name_categories)
+    num_buckets = len(year_range)
+    key = bucket[keep] * num_names + name_codes[keep]
+    totals = np.bincount(key, weights=df['NumOccurrences'].to_numpy()[keep],
+                         minlength=num_buckets * num_names)
+    present = np.bincount(key, minlength=num_buckets * num_names) > 0
+    return totals.reshape(num_buckets, num_names).astype(np.int64), \
+        present.reshape(num_buckets, num_names), name_categories
+
+
+def rank_table_from_totals(totals, present, name_categories, year_range):
+    """
+    Build the wide rank DataFrame from name_bucket_totals output.
+    Index is Name (only names present in at least one bucket), columns are f'{yr}' for each yr in year_range.
+    Ranks are float with NaN where the name has no data in that bucket.
+    """
+    bucket, name = np.nonzero(present)
+    rank = competition_rank(bucket, totals[bucket, name])
+
+    used = present.any(axis=0)
+    ranks = np.full(totals.shape, np.nan)
+    ranks[bucket, name] = rank
+
+    rank_df = pd.DataFrame(ranks[:, used].T,
+                           index=pd.Index(np.asarray(name_categories, dtype=object)[used], name='Name'),
+                           columns=[f'{yr}' for yr in year_range])
+    return rank_df.sort_index()
+
+
+def rank_year_ranges(df, year_range, states, sexes):
+    """
+    Vectorized replacement for compute_for_year_ranges in name_reference.py, same arguments and same result.
+    df is the names DataFrame with columns ['State', 'Sex', 'Year', 'Name', 'NumOccurrences'],
+    the string columns can be object or categorical.
+    year_range must be a range object. states == ['All'] uses every state in df.
+
+    All the names with the same count in a year bucket get the same rank (competition ranking).
+    """
+    if states == ['All']:
+        states = df['State'].unique()  # All the states in the input DataFrame
+
+    totals, present, name_categories = name_bucket_totals(df, year_range, states, sexes)
+    return rank_table_from_totals(totals, present, name_categories, year_range)
+
+
+def affected_buckets(year_range, years):
+    """
+    Start years of the buckets of year_range that contain any of years
+    """
+    bucket = year_bucket_codes(sorted(set(years)), year_range)
+    return sorted({year_range[b] for b in bucket if b >= 0})
+
+
+def extend_year_range(year_range, years):
+    """
+    year_range with stop moved out, if needed, so that every year in years falls in a bucket
+    """
+    last_year = max(years)
+    stop = year_range.stop
+    while year_range.start + ((stop - year_range.start - 1) // year_range.step + 1) * year_range.step <= last_year:
+        stop += year_range.step
+    return range(year_range.start, stop, year_range.step)
+
+
+def update_year_ranges(rank_df, names_cube, year_range, states, sexes, years):
+    """
+    Update a rank table from rank_year_ranges after the data of years was added or changed.
+    Only the bucket columns of year_range that contain years are recomputed (from names_cube), the other
+    columns are kept as they are. year_range is extended to cover years, adding new bucket columns.
+    Names new in the recomputed buckets get NaN in the other columns. Returns (rank_df, year_range)
+    """
+    year_range = extend_year_range(year_range, years)
+    rank_df = rank_df.copy()
+    for start_year in affected_buckets(year_range, years):
+        bucket_df = names_cube.rank_year_ranges(range(start_year, start_year + year_range.step, year_range.step),
+                                                states, sexes)
+        rank_df = rank_df.reindex(rank_df.index.union(bucket_df.index))
+        rank_df[f'{start_year}'] = bucket_df[f'{start_year}']
+    return rank_df[[f'{yr}' for yr in year_range if f'{yr}' in rank_df.columns]], year_range
+
+
+class NameCube:
+    """
+    Precomputed aggregate of the names DataFrame indexed by (state, sex, year, name).
+    Built once after loading. Any State/Sex/Year filter from the dashboard becomes array slicing,
+    the full table is never scanned again.
+
+    Two layouts are kept:
+    national  dense int32 array (sex, year, name) summed over all states. Used when every state is selected.
+    rows      the table sorted by (state, sex, year) with offsets, so one (state, sex) pair over a span
+              of years is a single contiguous slice of name codes and counts.
+
+    When df is already in (state, sex, year) order, like the names store, the rows are df's own
+    Name codes, Year and NumOccurrences arrays, not copies. If those are memory mapped from the store,
+    every worker process shares them. With national_file the national array is saved there the first
+    time and memory mapped after that, so it is shared too. Delete the file when the data changes
+    (name_data.write_name_store does).
+    """
+
+    def __init__(self, df, national_file=None):
+        name_codes, self.name_categories = encode_column(df['Name'])
+        state_codes, self.state_categories = encode_column(df['State'])
+        sex_codes, self.sex_categories = encode_column(df['Sex'])
+        years = df['Year'].to_numpy()
+        counts = df['NumOccurrences'].to_numpy()
+
+        num_names = len(self.name_categories)
+        num_sexes = len(self.sex_categories)
+        if len(years) > 0:
+            self.first_year = int(years.min())
+            self.num_years = int(years.max()) - self.first_year + 1
+        else:
+            self.first_year, self.num_years = 0, 0
+        year_idx = years.astype(np.int64) - self.first_year
+
+        national_shape = (num_sexes, self.num_years, num_names)
+        self.national = self._read_national(national_file, national_shape)
+        if self.national is None:
+            national_key = (sex_codes.astype(np.int64) * self.num_years + year_idx) * num_names + name_codes
+            self.national = np.bincount(national_key, weights=counts, minlength=int(np.prod(national_shape))) \
+                .astype(np.int32).reshape(national_shape)
+            del national_key
+            if national_file is not None:
+                self._write_national(national_file)
+
+        # The state files are already in (state, sex, year) order, only sort if they aren't
+        cell = (state_codes.astype(np.int64) * num_sexes + sex_codes) * self.num_years + year_idx
+        del year_idx
+        if len(cell) > 1 and not (np.diff(cell) >= 0).all():
+            order = np.argsort(cell, kind='stable')
+            cell, name_codes, counts, years = cell[order], name_codes[order], counts[order], years[order]
+        num_cells = len(self.state_categories) * num_sexes * self.num_years
+        self.cell_offsets = np.searchsorted(cell, np.arange(num_cells + 1))
+        # Kept in their compact dtypes (int16 name codes for up to 32767 names, int16 years, int32 counts)
+        self.row_names = name_codes
+        self.row_counts = counts
+        self.row_years = years
+
+    @staticmethod
+    def _read_national(national_file, shape):
+        if national_file is None:
+            return None
+        try:
+            national = np.load(national_file, mmap_mode='r', allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        if national.shape != shape or national.dtype != np.int32:
+            return None
+        return national
+
+    def _write_national(self, national_file):
+        national_file = Path(national_file)
+        # Replace the file, other processes may have the old one memory mapped
+        tmp_file = national_file.with_suffix(f'.{os.getpid()}.tmp.npy')
+        np.save(tmp_file, self.national, allow_pickle=False)
+        os.replace(tmp_file, national_file)
+
+    def year_span(self, year_range):
+        """
+        Return (year bucket of each cube year, first and last+1 cube year index covered by year_range)
+        """
+        cube_years = np.arange(self.first_year, self.first_year + self.num_years)
+        bucket = year_bucket_codes(cube_years, year_range)
+        covered = np.nonzero(bucket >= 0)[0]
+        if len(covered) == 0:
+            return bucket, 0, 0
+        return bucket, covered[0], covered[-1] + 1
+
+    def bucket_totals(self, year_range, states, sexes):
+        """
+        Same result as name_bucket_totals for the DataFrame the cube was built from.
+        Return (totals, present, name_categories), totals and present are (num buckets x num names)
+        """
+        num_names = len(self.name_categories)
+        num_buckets = len(year_range)
+        state_sel = np.nonzero(select_codes(self.state_categories, states))[0]
+        sex_sel = np.nonzero(select_codes(self.sex_categories, sexes))[0]
+        bucket, y_first, y_last = self.year_span(year_range)
+
+        totals = np.zeros((num_buckets, num_names), dtype=np.int64)
+        if y_first == y_last or len(state_sel) == 0 or len(sex_sel) == 0:
+            return totals, totals > 0, self.name_categories
+
+        if len(state_sel) == len(self.state_categories):
+            # Every state: sum the national cube over the selected sexes, then over the years of each bucket.
+            # Cube years of a bucket are contiguous so reduceat sums them in one call
+            by_year = self.national[sex_sel, y_first:y_last].sum(axis=0, dtype=np.int64)
+            span_bucket = bucket[y_first:y_last]
+            starts = np.nonzero(np.r_[True, span_bucket[1:] != span_bucket[:-1]])[0]
+            totals[span_bucket[starts]] = np.add.reduceat(by_year, starts, axis=0)
+            # SSA only publishes counts of 5 or more, so a total of 0 means the name has no rows
+            return totals, totals > 0, self.name_categories
+
+        # Some states: gather one contiguous slice per selected (state, sex) pair
+        num_sexes = len(self.sex_categories)
+        pairs = (state_sel[:, None] * num_sexes + sex_sel[None, :]).ravel()
+        starts = self.cell_offsets[pairs * self.num_years + y_first]
+        stops = self.cell_offsets[pairs * self.num_years + y_last]
+        rows = np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)])
+        key = bucket[self.row_years[rows] - self.first_year] * num_names + self.row_names[rows]
+        totals = np.bincount(key, weights=self.row_counts[rows], minlength=num_buckets * num_names)
+        present = np.bincount(key, minlength=num_buckets * num_names) > 0
+        return totals.reshape(num_buckets, num_names).astype(np.int64), \
+            present.reshape(num_buckets, num_names), self.name_categories
+
+    @timed(rows=count_rows)
+    def rank_year_ranges(self, year_range, states, sexes):
+        """
+        Same as rank_year_ranges(df, year_range, states, sexes) for the DataFrame the cube was built from
+        """
+        if states == ['All']:
+            states = self.state_categories
+
+        totals, present, name_categories = self.bucket_totals(year_range, states, sexes)
+        return rank_table_from_totals(totals, present, name_categories, year_range)
+
+
+def rank_year_ranges_by_state(df, year_range, sexes):
+    """
+    Rank names within each state, for every state in df in one grouped pass.
+    Same result as calling rank_year_ranges(df, year_range, [state], sexes) for every state and
+    concatenating them with a ('st_abb', 'names') MultiIndex, like concat_state_names_rank in name_choropleth.ipynb.
+    Rows are sorted by state, then name.
+    """
+    name_codes, name_categories = encode_column(df['Name'])
+    state_codes, state_categories = encode_column(df['State'])
+    sex_codes, sex_categories = encode_column(df['Sex'])
+
+    bucket = year_bucket_codes(df['Year'].to_numpy(), year_range)
+    keep = (bucket >= 0) & select_codes(sex_categories, sexes)[sex_codes]
+
+    # (state, bucket, name) is too sparse for a dense bincount over all states, so group with np.unique
+    num_names = len(name_categories)
+    num_buckets = len(year_range)
+    state_bucket = state_codes[keep].astype(np.int64) * num_buckets + bucket[keep]
+    key, key_inv = np.unique(state_bucket * num_names + name_codes[keep], return_inverse=True)
+    totals = np.bincount(key_inv, weights=df['NumOccurrences'].to_numpy()[keep], minlength=len(key))
+    rank = competition_rank(key // num_names, totals.astype(np.int64))
+
+    # One row for every (state, name) pair, one column for every bucket
+    state = key // num_names // num_buckets
+    row_key, row_inv = np.unique(state * num_names + key % num_names, return_inverse=True)
+    ranks = np.full((len(row_key), num_buckets), np.nan)
+    ranks[row_inv, key // num_names % num_buckets] = rank
+
+    index = pd.MultiIndex.from_arrays(
+        [np.asarray(state_categories, dtype=object)[row_key // num_names],
+         np.asarray(name_categories, dtype=object)[row_key % num_names]],
+        names=['st_abb', 'names'])
+    # Sort by the labels, the codes aren't in order if categories were appended (see name_data.append_name_years)
+    return pd.DataFrame(ranks, index=index, columns=[f'{yr}' for yr in year_range]).sort_index()
+
+
+# State and Sex label of the rollups in rank_views, like the states == ['All'] argument of the rank functions
+ALL = 'All'
+RANK_VIEW_COLUMNS = ['State', 'Sex', 'Year', 'Name', 'NumOccurrences', 'Rank']
+
+
+def group_totals(group, name, totals):
+    """
+    Sum totals by (group, name). Return (group, name, totals) of the distinct pairs
+    """
+    num_names = int(name.max()) + 1 if len(name) else 1
+    key, key_inv = np.unique(group * num_names + name, return_inverse=True)
+    return key // num_names, key % num_names, np.bincount(key_inv, weights=totals, minlength=len(key)).astype(np.int64)
+
+
+def rank_views(df, year_range, sexes=('M', 'F'), national=True):
+    """
+    Ranks of every (state, sex, year bucket) view of df from one grouped pass over the rows, plus rollups:
+    Sex 'All' (the sexes in sexes combined) for every state and, with national=True, State 'All'
+    (every state combined) for every sex and for both. The rollups are summed from the per view totals,
+    so the rows are only grouped once, and all the views are ranked together in one competition_rank call.
+
+    Returns a tidy DataFrame with columns State, Sex, Year (start of the bucket), Name, NumOccurrences
+    (total in the bucket) and Rank, one row per name present in a view, sorted by view then rank.
+    State, Sex and Name are categoricals. Select a view with rank_view.
+    The ranks of State s, Sex x equal rank_year_ranges(df, year_range, [s], [x]), with 'All' meaning
+    every state or every sex in sexes.
+    """
+    name_codes, name_categories = encode_column(df['Name'])
+    state_codes, state_categories = encode_column(df['State'])
+    sex_codes, sex_categories = encode_column(df['Sex'])
+
+    bucket = year_bucket_codes(df['Year'].to_numpy(), year_range)
+    keep = (bucket >= 0) & select_codes(sex_categories, sexes)[sex_codes]
+
+    # View codes: states then ALL, sexes then ALL. A view and bucket make one group
+    num_states = len(state_categories) + 1
+    num_sexes = len(sex_categories) + 1
+    num_buckets = len(year_range)
+    group = (state_codes[keep].astype(np.int64) * num_sexes + sex_codes[keep]) * num_buckets + bucket[keep]
+    group, name, totals = group_totals(group, name_codes[keep], df['NumOccurrences'].to_numpy()[keep])
+
+    parts = [(group, name, totals)]
+    state_view, rest = np.divmod(group, num_sexes * num_buckets)
+    sex_view, bucket_view = np.divmod(rest, num_buckets)
+    # Both sexes of each state
+    parts.append(group_totals((state_view * num_sexes + num_sexes - 1) * num_buckets + bucket_view, name, totals))
+    if national:
+        # Every state for each sex, then every state for both sexes
+        national_sex = group_totals(((num_states - 1) * num_sexes + sex_view) * num_buckets + bucket_view, name, totals)
+        parts.append(national_sex)
+        national_group, national_name, national_totals = national_sex
+        parts.append(group_totals(((num_states - 1) * num_sexes + num_sexes - 1) * num_buckets
+                                  + national_group % num_buckets, national_name, national_totals))
+
+    group = np.concatenate([p[0] for p in parts])
+    name = np.concatenate([p[1] for p in parts])
+    totals = np.concatenate([p[2] for p in parts])
+    rank = competition_rank(group, totals)
+
+    # Sort by view and bucket, then rank. The names of a group are in code order and the sort is stable,
+    # so equal ranks stay sorted by name
+    order = np.argsort(group * (int(rank.max(initial=0)) + 1) + rank, kind='stable')
+    group, name, totals, rank = group[order], name[order], totals[order], rank[order]
+    state_view, rest = np.divmod(group, num_sexes * num_buckets)
+    sex_view, bucket_view = np.divmod(rest, num_buckets)
+    return pd.DataFrame({
+        'State': pd.Categorical.from_codes(state_view, categories=list(state_categories) + [ALL]),
+        'Sex': pd.Categorical.from_codes(sex_view, categories=list(sex_categories) + [ALL]),
+        'Year': (year_range.start + bucket_view * year_range.step).astype(np.int16),
+        'Name': pd.Categorical.from_codes(name, categories=name_categories),
+        'NumOccurrences': totals,
+        'Rank': rank.astype(np.int32),
+    })
+
+
+def rank_view(views_df, year_range, state=ALL, sex=ALL):
+    """
+    Wide rank table of one view of rank_views, without recomputing anything.
+    With a state it is the Name x bucket table of rank_year_ranges. With state=None every state
+    except the ALL rollup is kept, in the ('st_abb', 'names') layout of rank_year_ranges_by_state
+    used by the choropleth.
+    """
+    rows = views_df[(views_df['Sex'] == sex).to_numpy() &
+                    ((views_df['State'] != ALL) if state is None else (views_df['State'] == state)).to_numpy()]
+    columns = [f'{yr}' for yr in year_range]
+    bucket = year_bucket_codes(rows['Year'].to_numpy(), year_range)
+    names = rows['Name'].to_numpy(dtype=object)
+    if state is None:
+        states = rows['State'].to_numpy(dtype=object)
+        index = pd.MultiIndex.from_arrays([states, names], names=['st_abb', 'names'])
+    else:
+        index = pd.Index(names, name='Name')
+    row_index = index.unique().sort_values()
+    ranks = np.full((len(row_index), len(columns)), np.nan)
+    ranks[row_index.get_indexer(index), bucket] = rows['Rank'].to_numpy()
+    return pd.DataFrame(ranks, index=row_index, columns=columns)
+
+
+class BucketAccumulator:
+    """
+    Folds chunks of the names table into per (year bucket, name) sums, for data that doesn't fit in memory.
+    Memory is (num buckets x distinct names) no matter how many rows are added.
+    states == ['All'] keeps every state.
+    """
+
+    def __init__(self, year_range, states, sexes):
+        self.year_range = year_range
+        self.states = None if states == ['All'] else set(states)
+        self.sexes = set(sexes)
+        self.name_codes = {}    # name -> column in totals, in order of first appearance
+        self.totals = np.zeros((len(year_range), 1024), dtype=np.int64)
+        self.present = np.zeros((len(year_range), 1024), dtype=bool)
+        self.rows_added = 0
+
+    def add(self, chunk):
+        """
+        Add a DataFrame chunk with the columns ['State', 'Sex', 'Year', 'Name', 'NumOccurrences']
+        """
+        self.rows_added += len(chunk)
+        bucket = year_bucket_codes(chunk['Year'].to_numpy(), self.year_range)
+        keep = (bucket >= 0) & chunk['Sex'].isin(self.sexes).to_numpy()
+        if self.states is not None:
+            keep &= chunk['State'].isin(self.states).to_numpy()
+        if not keep.any():
+            return
+
+        chunk_codes, chunk_names = pd.factorize(chunk['Name'].to_numpy()[keep])
+        # Only the distinct names of the chunk go through the dict
+        to_global = np.array([self.name_codes.setdefault(n, len(self.name_codes)) for n in chunk_names],
+                             dtype=np.int64)
+        num_names = len(self.name_codes)
+        if num_names > self.totals.shape[1]:
+            capacity = max(num_names, 2 * self.totals.shape[1])
+            self.totals = np.pad(self.totals, ((0, 0), (0, capacity - self.totals.shape[1])))
+            self.present = np.pad(self.present, ((0, 0), (0, capacity - self.present.shape[1])))
+
+        key = bucket[keep] * num_names + to_global[chunk_codes]
+        num_buckets = len(self.year_range)
+        self.totals[:, :num_names] += np.bincount(
+            key, weights=chunk['NumOccurrences'].to_numpy()[keep],
+            minlength=num_buckets * num_names).astype(np.int64).reshape(num_buckets, num_names)
+        self.present[:, :num_names] |= (np.bincount(key, minlength=num_buckets * num_names) > 0) \
+            .reshape(num_buckets, num_names)
+
+    def name_categories(self):
+        return np.array(list(self.name_codes), dtype=object)
+
+    def rank_table(self):
+        """
+        Same result as rank_year_ranges on all the rows added
+        """
+        num_names = len(self.name_codes)
+        return rank_table_from_totals(self.totals[:, :num_names], self.present[:, :num_names],
+                                      self.name_categories(), self.year_range)
+
+
+def stream_rank_year_ranges(chunks, year_range, states, sexes):
+    """
+    Out of core rank_year_ranges. chunks is an iterable of names DataFrame chunks,
+    e.g. name_data.stream_name_chunks(files_list), so the whole table is never in memory
+    """
+    accumulator = BucketAccumulator(year_range, states, sexes)
+    for chunk in chunks:
+        accumulator.add(chunk)
+    return accumulator.rank_table()
+
+
+def stream_name_occurences(chunks, states, sexes, years):
+    """
+    Out of core compute_name_occurences from name_reference.py. Returns the same DataFrame
+    ['Name', 'NumOccurrences'] sorted by NumOccurrences, largest first
+    """
+    years = sorted(set(years))
+    # One bucket covering all the years, the years in between that aren't in years are dropped per chunk
+    accumulator = BucketAccumulator(range(years[0], years[-1] + 1, years[-1] - years[0] + 1), states, sexes)
+    for chunk in chunks:
+        accumulator.add(chunk[chunk['Year'].isin(years)])
+    num_names = len(accumulator.name_codes)
+    totals = accumulator.totals[0, :num_names]
+    present = accumulator.present[0, :num_names]
+    name_occurrences_df = pd.DataFrame({'Name': accumulator.name_categories()[present],
+                                        'NumOccurrences': totals[present]})
+    return name_occurrences_df.sort_values('NumOccurrences', ascending=False, kind='stable').reset_index(drop=True)
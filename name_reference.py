@@ -0,0 +1,86 @@
+# Original loop based name rank functions, the reference the vectorized engines of name_rank.py are checked against
+import pandas as pd
+
+from name_metrics import count_rows, stage, timed
+
+
+@timed(rows=count_rows)
+def compute_name_occurences(df, states, sexes, years):
+    """ df is the names DataFrame that has columns 
+    ['State', 'Sex', 'Year', 'Name', 'NumOccurrences'], Year and NumOccurrences are int32
+    states, sexes and years can be list, range, or set
+    Note:
+    Between 10% and 20% Male and Female names are the same so be aware when using both sexes
+    """
+    # observed=True so unused Name categories don't show up with a count of 0
+    name_occurrences_df = df[(df['State'].isin(states)) & (df['Sex'].isin(sexes)) & (df['Year'].isin(years))
+                             ].groupby(by=['Name'], observed=True)[['NumOccurrences']].sum()
+    name_occurrences_df = name_occurrences_df.sort_values(
+        'NumOccurrences', ascending=False).reset_index()
+
+    return name_occurrences_df[['Name', 'NumOccurrences']]
+
+
+@timed(rows=count_rows)
+def compute_for_year_ranges(df, year_range, states, sexes):
+    """
+    All the names with the same count will get the same rank. There are many names that have same count.
+    df is the names DataFrame that has columns 
+    ['State', 'Sex', 'Year', 'Name', 'NumOccurrences'], Year and NumOccurrences are int32
+
+    year_range must be a range object 
+
+    This is the reference implementation. The app uses NameCube.rank_year_ranges from name_rank.py,
+    tests/test_name_rank.py checks that it gives the same result
+    """
+    # name_rank_year_ranges_df has index of all names. Columns = [Rank_<Year_range_1>,Rank_<Year_range_2>, Rank_<Year_range_3>, ...]
+    name_rank_year_ranges_df = pd.DataFrame()   # Empty df to hold accumulated ranks
+
+    if states == ['All']:
+        states = df['State'].unique()  # All the states in the input DataFrame
+
+    # TODO: if year_range == 'All' then set range(1900,2020)
+
+    for yr in year_range:
+        # Each value of yr will be the start year of the sub_year_range.
+        # yr+yr.step will be the stop year of the sub_year_range.
+        # sub_year_range will have a step size of 1
+        sub_year_range = range(yr, yr+year_range.step, 1)
+
+        # Find number of occurrences for a given name
+        name_occurrences_df = compute_name_occurences(
+            df, states, sexes, sub_year_range)
+        count_num_occ = name_occurrences_df.groupby('NumOccurrences').count(
+        ).sort_values('NumOccurrences', ascending=False).reset_index()
+
+        # Compute rank for a given NumOccurrences. Then match name to number of occurrences
+        # It makes sense to iterate using iterrows since the current_rank keeps accumulating
+        # ['NumOccurrences','NumNames','Rank']
+        # NumNames is the number of Names that have number of occurrences equal to NumOccurrences
+        with stage('compute_for_year_ranges.rank'):
+            all_ranks_list = []
+            current_rank = 1
+            for idx, r in count_num_occ.iterrows():
+                if idx != 0:
+                    current_rank += count_num_occ.loc[idx-1, 'Name']
+
+                all_ranks_list.append(
+                    [r['NumOccurrences'], r['Name'], current_rank])
+            all_ranks_df = pd.DataFrame(all_ranks_list, columns=[
+                                        'NumOccurrences', 'NumNames', f'{yr}'])
+
+        # merge performs a database join of the type specified by how=
+        # Set Name as the index to make it easier to get the rank using .loc
+        # nameRank_df has index of all the names. Columns = [NumOccurrences,	NumNames,	Rank]
+        with stage('compute_for_year_ranges.merge'):
+            nameRank_df = name_occurrences_df.merge(
+                all_ranks_df, on='NumOccurrences', how='inner').set_index('Name')
+            # Get just the Rank and merge it with name_rank_year_ranges_df
+            merged_e_df = name_rank_year_ranges_df.merge(
+                nameRank_df[[f'{yr}']], left_index=True, right_index=True, how='outer')
+
+         # Don't replace NaN with 0. Plotly handles nan, by just skipping those values which is what we want.
+        # merged_e_df.fillna(value=0, inplace=True)
+        name_rank_year_ranges_df = merged_e_df
+
+    return name_rank_year_ranges_df
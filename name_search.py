@@ -0,0 +1,139 @@
+# Prefix and typo tolerant search over the distinct names, for the name inputs of the apps
+from bisect import bisect_left
+
+import numpy as np
+
+# Suggestions returned by default
+SUGGESTION_LIMIT = 10
+# Number of names sharing the most trigrams with the text that are compared with it, besides the single typo matches
+TYPO_CANDIDATES = 64
+
+
+def name_trigrams(key):
+    """
+    Set of the 3 character substrings of key padded with ^ and $, so short names and the
+    first and last letters count too
+    """
+    padded = f'^{key}$'
+    return {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+
+
+def single_deletes(key):
+    """
+    key and every string made by deleting one character of it
+    """
+    return {key} | {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+def edit_distance(a, b):
+    """
+    Edit distance between a and b where an insert, delete, substitution or swap of two
+    adjacent characters (Jhon -> John) costs 1. Only called on a few short names per search
+    """
+    rows = [list(range(len(b) + 1))]
+    for i in range(1, len(a) + 1):
+        row = [i]
+        for j in range(1, len(b) + 1):
+            d = min(rows[i - 1][j] + 1, row[j - 1] + 1, rows[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d = min(d, rows[i - 2][j - 2] + 1)
+            row.append(d)
+        rows.append(row)
+    return rows[-1][-1]
+
+
+class NameSearchIndex:
+    """
+    Search index over a list of distinct names, built once at startup.
+    Names are compared case insensitively.
+    prefix        names starting with the text, by bisecting the sorted lower case names
+    did_you_mean  names within a small edit distance of the text. The candidates come from an index of
+                  the names with one character deleted (catches any single typo) and a trigram index,
+                  so only a few names are compared per search
+    weights (e.g. total occurrences) order the results, most popular first.
+    """
+
+    def __init__(self, names, weights=None):
+        names = np.asarray(names, dtype=object)
+        keys = np.array([n.lower() for n in names], dtype=object)
+        order = np.argsort(keys, kind='stable')
+        self.names = names[order]
+        self.keys = list(keys[order])
+        if weights is None:
+            self.weights = np.zeros(len(names))
+        else:
+            self.weights = np.asarray(weights, dtype=np.float64)[order]
+        # First name for every lower case key, so 'john' resolves to 'John'
+        self.exact = {}
+        for key, name in zip(self.keys, self.names):
+            self.exact.setdefault(key, name)
+
+        postings = {}
+        self.deletes = {}
+        for i, key in enumerate(self.keys):
+            for gram in name_trigrams(key):
+                postings.setdefault(gram, []).append(i)
+            for variant in single_deletes(key):
+                self.deletes.setdefault(variant, []).append(i)
+        self.trigrams = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def match(self, text):
+        """
+        The name equal to text ignoring case and surrounding spaces, or None
+        """
+        return self.exact.get(text.strip().lower())
+
+    def _most_popular(self, ids, limit):
+        if len(ids) > limit:
+            ids = ids[np.argpartition(-self.weights[ids], limit - 1)[:limit]]
+        # Most popular first, then alphabetical
+        return ids[np.lexsort((ids, -self.weights[ids]))]
+
+    def prefix(self, text, limit=SUGGESTION_LIMIT):
+        """
+        Up to limit names starting with text, most popular first
+        """
+        key = text.strip().lower()
+        if not key:
+            return []
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + '\uffff', lo)
+        return list(self.names[self._most_popular(np.arange(lo, hi), limit)])
+
+    def did_you_mean(self, text, limit=5, max_distance=2):
+        """
+        Up to limit names at most max_distance edits from text (not counting a case change),
+        closest first and then most popular first. text itself isn't returned
+        """
+        key = text.strip().lower()
+        if not key:
+            return []
+        # Names one typo away share a single delete variant with key
+        candidates = set()
+        for variant in single_deletes(key):
+            candidates.update(self.deletes.get(variant, ()))
+        # Names further away are likely to share many trigrams with key
+        grams = [self.trigrams[g] for g in name_trigrams(key) if g in self.trigrams]
+        if len(grams) > 0:
+            shared = np.bincount(np.concatenate(grams), minlength=len(self.names))
+            similar = np.flatnonzero(shared)
+            if len(similar) > TYPO_CANDIDATES:
+                similar = similar[np.argpartition(-shared[similar], TYPO_CANDIDATES - 1)[:TYPO_CANDIDATES]]
+            candidates.update(similar.tolist())
+        scored = []
+        for i in candidates:
+            if abs(len(self.keys[i]) - len(key)) > max_distance or self.keys[i] == key:
+                continue
+            distance = edit_distance(key, self.keys[i])
+            if distance <= max_distance:
+                scored.append((distance, -self.weights[i], self.keys[i], i))
+        return [self.names[i] for *_, i in sorted(scored)[:limit]]
+
+    def suggest(self, text, limit=SUGGESTION_LIMIT):
+        """
+        Names for a typeahead list: the prefix matches, or the did_you_mean names if nothing starts with text
+        """
+        return self.prefix(text, limit) or self.did_you_mean(text, limit)
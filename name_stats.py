@@ -0,0 +1,120 @@
+# Name groups computed from a rank table, e.g. the names whose rank varied the most
+import numpy as np
+import pandas as pd
+
+from name_metrics import count_rows, timed
+
+STATS_COLUMNS = ['Group', 'Name', 'Value']
+
+
+def top_k(values, k, largest=True):
+    """
+    Positions of the k largest (or smallest) values, best first. NaN values are never picked.
+    Only the k picked values are sorted, ties keep the table order
+    """
+    positions = np.flatnonzero(~np.isnan(values))
+    values = values[positions]
+    if not largest:
+        values = -values
+    if len(positions) > k:
+        picked = np.argpartition(-values, k - 1)[:k]
+        positions, values = positions[picked], values[picked]
+    order = np.lexsort((positions, -values))
+    return positions[order]
+
+
+def most_variance(ranks, k=10):
+    """
+    Names with the greatest variance in rank over the years.
+    Names missing from any bucket (rank NaN) are left out
+    """
+    present = ~np.isnan(ranks).any(axis=1)
+    var = np.full(len(ranks), np.nan)
+    if ranks.shape[1] > 1:
+        var[present] = ranks[present].var(axis=1, ddof=1)
+    positions = top_k(var, k)
+    return positions, var[positions]
+
+
+def top_new_names(ranks, k=50):
+    """
+    Names ranked in the last bucket but not in the first one, highest last rank first
+    """
+    new = np.where(np.isnan(ranks[:, 0]), ranks[:, -1], np.nan)
+    positions = top_k(new, k, largest=False)
+    return positions, new[positions]
+
+
+def biggest_climbers(ranks, k=10):
+    """
+    Names ranked in the first and last bucket that gained the most places between them
+    """
+    gain = ranks[:, 0] - ranks[:, -1]
+    positions = top_k(gain, k)
+    return positions, gain[positions]
+
+
+def fastest_decliners(ranks, k=10):
+    """
+    Names ranked in the first and last bucket that lost the most places between them
+    """
+    loss = ranks[:, -1] - ranks[:, 0]
+    positions = top_k(loss, k)
+    return positions, loss[positions]
+
+
+def peak_buckets(ranks):
+    """
+    Column position of every name's best (lowest) rank, -1 if the name is never ranked
+    """
+    missing = np.isnan(ranks)
+    peaks = np.where(missing, np.inf, ranks).argmin(axis=1)
+    peaks[missing.all(axis=1)] = -1
+    return peaks
+
+
+def peaking_now(ranks, k=10):
+    """
+    Names whose best rank is in the last bucket, highest last rank first
+    """
+    now = np.where(peak_buckets(ranks) == ranks.shape[1] - 1, ranks[:, -1], np.nan)
+    positions = top_k(now, k, largest=False)
+    return positions, now[positions]
+
+
+# Group name (as shown in the app) -> function of the rank array returning (row positions, values) best first.
+# To add a group, write a function like the ones above and add it here
+GROUP_STATS = {
+    'Top 50 New Names': top_new_names,
+    'Most Variance': most_variance,
+    'Biggest Climbers': biggest_climbers,
+    'Fastest Decliners': fastest_decliners,
+    'Peaking Now': peaking_now,
+}
+
+
+@timed(rows=count_rows)
+def rank_table_stats(result_df, groups=GROUP_STATS):
+    """
+    Compute every group of GROUP_STATS for a rank table (Name index, one column per year bucket).
+    Returns a DataFrame with columns Group, Name and Value, the names of each group best first.
+    None of the groups depend on the names picked in the app, so this is done once per rank table
+    """
+    ranks = result_df.to_numpy(dtype=np.float64, na_value=np.nan)
+    frames = []
+    if len(ranks) > 0 and ranks.shape[1] > 0:
+        for group, func in groups.items():
+            positions, values = func(ranks)
+            frames.append(pd.DataFrame({'Group': group,
+                                        'Name': result_df.index[positions],
+                                        'Value': values}))
+    if len(frames) == 0:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in zip(STATS_COLUMNS, [str, str, 'float64'])})
+    return pd.concat(frames, ignore_index=True)
+
+
+def group_names(stats_df, group):
+    """
+    Names of one group from rank_table_stats, best first
+    """
+    return list(stats_df.loc[stats_df['Group'] == group, 'Name'])
@@ -0,0 +1,61 @@
+# Synthetic SSA names shared by the tests
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from name_data import NAME_COLUMNS  # noqa: E402
+
+STATES = ['AK', 'AL', 'CA', 'NY']
+SEXES = ['F', 'M']
+NAMES = ['Ann', 'Bob', 'Cy', 'Dee', 'Eve', 'Flo', 'Gus', 'Hal', 'Ida', 'Jo', 'Kim', 'Lee']
+
+
+def synthetic_names(seed=1910):
+    """
+    Rows in (state, sex, year) order like the state files. Counts come from a few values
+    so many names tie within a bucket, and about a third of the (state, sex, year, name) rows are missing
+    so some names have no rows in some buckets
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for st in STATES:
+        for sex in SEXES:
+            for yr in range(1910, 1922):
+                for name in NAMES:
+                    if rng.random() < 0.35:
+                        continue
+                    rows.append([st, sex, yr, name, int(rng.choice([5, 6, 7, 12]))])
+    df = pd.DataFrame(rows, columns=NAME_COLUMNS)
+    df['Year'] = df['Year'].astype('int16')
+    df['NumOccurrences'] = df['NumOccurrences'].astype('int32')
+    return df
+
+
+def write_state_files(df, out_dir):
+    """
+    Write df as SSA state files, out_dir/AK.TXT etc. without a header. Return out_dir
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for st, st_df in df.groupby('State', sort=True):
+        st_df[NAME_COLUMNS].to_csv(out_dir / f'{st}.TXT', header=False, index=False)
+    return out_dir
+
+
+@pytest.fixture(scope='session')
+def names_df():
+    return synthetic_names()
+
+
+@pytest.fixture(scope='session')
+def names_dir(names_df, tmp_path_factory):
+    """
+    Directory with the state files of names_df
+    """
+    return write_state_files(names_df, tmp_path_factory.mktemp('NamesByState'))
@@ -0,0 +1,75 @@
+# Apply Filters in name_dash_app.py with the rank-job Store value as the browser sends it back (JSON)
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from name_cache import result_key
+
+STATES = ['Alaska', 'Alabama']
+POLL_TIMEOUT_S = 60
+
+
+@pytest.fixture(scope='module')
+def dash_app(names_dir):
+    old_path = os.environ.get('NAMESURFER_NAMES_PATH')
+    os.environ['NAMESURFER_NAMES_PATH'] = str(names_dir)
+    import name_dash_app
+    yield name_dash_app
+    name_dash_app.rank_jobs.shutdown()
+    if old_path is None:
+        del os.environ['NAMESURFER_NAMES_PATH']
+    else:
+        os.environ['NAMESURFER_NAMES_PATH'] = old_path
+
+
+def apply_filters(app, rank_job, states, start_year=1910, end_year=1920, year_step=5):
+    """
+    Click Apply Filters and return the rank-job Store value after a round trip through JSON
+    """
+    store, poll_disabled = app.store_result_df(['Female', 'Male'], states, start_year, end_year, year_step,
+                                               rank_job, 1)
+    assert poll_disabled is False
+    return json.loads(json.dumps(store))
+
+
+def wait_for_job(app, rank_job):
+    key = result_key(*rank_job['key'])
+    deadline = time.monotonic() + POLL_TIMEOUT_S
+    while (state := app.rank_jobs.poll(key)[0]) == 'running':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return state
+
+
+def test_apply_filters_again_with_the_same_filters(dash_app):
+    first = apply_filters(dash_app, None, STATES)
+    key = result_key(*first['key'])
+    # The session joins the job it already waits for, it doesn't subscribe twice
+    again = apply_filters(dash_app, first, STATES)
+    assert result_key(*again['key']) == key
+    assert dash_app.rank_jobs._jobs[key].subscribers == 1
+    assert wait_for_job(dash_app, again) == 'done'
+    pd.testing.assert_frame_equal(dash_app.result_cache.get(key), dash_app.get_rank_table(key))
+
+
+def test_apply_filters_with_other_filters_cancels_the_previous_job(dash_app):
+    first = apply_filters(dash_app, None, STATES, end_year=1915)
+    key = result_key(*first['key'])
+    other = apply_filters(dash_app, first, ['California'])
+    assert key not in dash_app.rank_jobs._jobs
+    assert dash_app.rank_jobs.poll(key)[0] == 'missing'
+    assert wait_for_job(dash_app, other) == 'done'
+    other_key = result_key(*other['key'])
+    expected = dash_app.names_cube.rank_year_ranges(range(1910, 1920, 5), ['CA'], ['F', 'M'])
+    pd.testing.assert_frame_equal(dash_app.result_cache.get(other_key), expected)
+
+
+def test_apply_filters_without_year_buckets(dash_app):
+    rank_job = apply_filters(dash_app, None, STATES, start_year=1920, end_year=1910)
+    assert wait_for_job(dash_app, rank_job) == 'done'
+    key = result_key(*rank_job['key'])
+    pd.testing.assert_frame_equal(dash_app.result_cache.get(key), dash_app.names_cube.rank_year_ranges(
+        range(1920, 1910, 5), list(key[1]), list(key[0])))
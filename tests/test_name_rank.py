@@ -0,0 +1,80 @@
+# The vectorized rank engines of name_rank.py give the same rank table as compute_for_year_ranges
+import pandas as pd
+import pytest
+
+from conftest import SEXES, STATES
+from name_choropleth_data import build_rank_views, build_state_ranks, read_state_ranks
+from name_data import NAME_COLUMNS, encode_names_df
+from name_rank import ALL, NameCube, rank_view, rank_views, rank_year_ranges, rank_year_ranges_by_state
+from name_reference import compute_for_year_ranges
+
+VIEWS_YEAR_RANGE = range(1910, 1920, 5)
+
+def reference_ranks(df, year_range, states, sexes):
+    reference_df = compute_for_year_ranges(df, year_range, states, sexes)
+    reference_df.index = reference_df.index.astype(str)
+    return reference_df.rename_axis('Name').sort_index()
+
+
+@pytest.mark.parametrize('states', [['All'], ['AK'], ['AL', 'NY']])
+@pytest.mark.parametrize('sexes', [['F', 'M'], ['M']])
+@pytest.mark.parametrize('year_range', [range(1910, 1922, 1), range(1910, 1920, 5), range(1912, 1921, 3)])
+def test_rank_year_ranges_matches_reference(names_df, year_range, states, sexes):
+    expected = reference_ranks(names_df, year_range, states, sexes)
+    # Object columns and the categorical columns of the names store
+    for df in [names_df, encode_names_df(names_df)]:
+        result = rank_year_ranges(df, year_range, states, sexes)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_index_type=False)
+
+
+@pytest.mark.parametrize('states', [['All'], ['AK'], ['AL', 'NY']])
+@pytest.mark.parametrize('sexes', [['F', 'M'], ['F']])
+def test_name_cube_matches_reference(names_df, states, sexes):
+    year_range = range(1910, 1920, 5)
+    result = NameCube(encode_names_df(names_df)).rank_year_ranges(year_range, states, sexes)
+    pd.testing.assert_frame_equal(result, reference_ranks(names_df, year_range, states, sexes),
+                                  check_dtype=False, check_index_type=False)
+
+
+def test_ties_share_the_competition_rank():
+    df = pd.DataFrame([['AK', 'F', 1910, 'Ann', 9], ['AK', 'F', 1910, 'Bob', 7],
+                       ['AK', 'F', 1910, 'Cy', 7], ['AK', 'F', 1910, 'Dee', 5]], columns=NAME_COLUMNS)
+    result = rank_year_ranges(df, range(1910, 1911), ['All'], ['F'])
+    assert result['1910'].to_dict() == {'Ann': 1.0, 'Bob': 2.0, 'Cy': 2.0, 'Dee': 4.0}
+    pd.testing.assert_frame_equal(result, reference_ranks(df, range(1910, 1911), ['All'], ['F']),
+                                  check_dtype=False, check_index_type=False)
+
+
+@pytest.fixture(scope='module')
+def views_df(names_df):
+    return rank_views(names_df, VIEWS_YEAR_RANGE, SEXES)
+
+
+@pytest.mark.parametrize('state', STATES + [ALL])
+@pytest.mark.parametrize('sex', SEXES + [ALL])
+def test_rank_view_matches_rank_year_ranges(names_df, views_df, state, sex):
+    # Sex 'All' is both sexes of the state, State 'All' the national rollup
+    expected = rank_year_ranges(names_df, VIEWS_YEAR_RANGE, ['All'] if state == ALL else [state],
+                                SEXES if sex == ALL else [sex])
+    pd.testing.assert_frame_equal(rank_view(views_df, VIEWS_YEAR_RANGE, state, sex), expected,
+                                  check_dtype=False, check_index_type=False)
+
+
+@pytest.mark.parametrize('sex', SEXES + [ALL])
+def test_rank_view_of_every_state_matches_rank_year_ranges_by_state(names_df, views_df, sex):
+    expected = rank_year_ranges_by_state(names_df, VIEWS_YEAR_RANGE, SEXES if sex == ALL else [sex])
+    pd.testing.assert_frame_equal(rank_view(views_df, VIEWS_YEAR_RANGE, None, sex), expected,
+                                  check_dtype=False, check_index_type=False)
+
+
+def test_read_state_ranks_of_a_views_file(names_df, names_dir, tmp_path):
+    views_file = tmp_path / 'views.parquet'
+    build_rank_views(names_dir, views_file, VIEWS_YEAR_RANGE, SEXES)
+    expected = rank_year_ranges_by_state(names_df, VIEWS_YEAR_RANGE, SEXES)
+    pd.testing.assert_frame_equal(read_state_ranks(views_file), expected, check_dtype=False, check_index_type=False)
+    # The same table as the build_state_ranks dataset, also with a filter on the names
+    build_state_ranks(names_dir, tmp_path / 'state_ranks', VIEWS_YEAR_RANGE, SEXES)
+    filters = [('names', 'in', ['Ann', 'Lee'])]
+    pd.testing.assert_frame_equal(read_state_ranks(views_file, filters=filters),
+                                  read_state_ranks(tmp_path / 'state_ranks', filters=filters),
+                                  check_dtype=False, check_index_type=False)
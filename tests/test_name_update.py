@@ -0,0 +1,51 @@
+# Adding newly published years (update_names_year.py) gives the same store and rank tables as a full rebuild
+import pandas as pd
+import pytest
+
+from conftest import SEXES, write_state_files
+from name_choropleth_data import build_state_ranks, read_state_ranks, update_state_ranks_years
+from name_data import append_name_years, load_name_store
+from name_rank import NameCube
+from update_names_year import update_national_ranks
+
+NEW_YEARS = [1920, 1921]
+OLD_YEAR_RANGE = range(1910, 1920, 5)
+# Extended by the bucket of the new years
+NEW_YEAR_RANGE = range(1910, 1925, 5)
+
+
+def decoded(names_df):
+    """
+    The store with its categorical columns as strings, appended categories aren't in sorted order
+    """
+    return names_df.astype({col: str for col in ['State', 'Sex', 'Name']})
+
+
+@pytest.mark.parametrize('partition_by', ['state', 'initial'])
+def test_update_equals_full_rebuild(names_df, names_dir, tmp_path, partition_by):
+    update_dir = write_state_files(names_df[~names_df['Year'].isin(NEW_YEARS)], tmp_path / 'NamesByState')
+    state_ranks_dir = tmp_path / 'state_ranks'
+    national_file = tmp_path / 'national_ranks.parquet'
+    build_state_ranks(update_dir, state_ranks_dir, OLD_YEAR_RANGE, SEXES, partition_by=partition_by)
+    NameCube(load_name_store(update_dir)).rank_year_ranges(OLD_YEAR_RANGE, ['All'], SEXES).to_parquet(national_file)
+
+    # SSA publishes the new years: the state files now have every year
+    write_state_files(names_df, update_dir)
+    updated_df = append_name_years(update_dir, NEW_YEARS)
+    update_state_ranks_years(updated_df, state_ranks_dir, NEW_YEARS, files_path=update_dir)
+    year_range = update_national_ranks(NameCube(updated_df), national_file, NEW_YEARS, OLD_YEAR_RANGE, SEXES)
+    assert year_range == NEW_YEAR_RANGE
+
+    full_df = load_name_store(names_dir)
+    pd.testing.assert_frame_equal(decoded(updated_df), decoded(full_df))
+    # The updated store is read back as is
+    pd.testing.assert_frame_equal(decoded(load_name_store(update_dir)), decoded(full_df))
+
+    pd.testing.assert_frame_equal(pd.read_parquet(national_file),
+                                  NameCube(full_df).rank_year_ranges(NEW_YEAR_RANGE, ['All'], SEXES))
+
+    full_ranks_dir = tmp_path / 'full_state_ranks'
+    build_state_ranks(names_dir, full_ranks_dir, NEW_YEAR_RANGE, SEXES, partition_by=partition_by)
+    pd.testing.assert_frame_equal(read_state_ranks(state_ranks_dir), read_state_ranks(full_ranks_dir))
+    # The manifest records the new files as built, so the next build has nothing to rank
+    assert build_state_ranks(update_dir, state_ranks_dir, NEW_YEAR_RANGE, SEXES, partition_by=partition_by) == []
@@ -0,0 +1,66 @@
+# Command line yearly refresh: add a newly published SSA year without rebuilding everything
+# Example, after copying the new state files over NamesByState:
+#   python update_names_year.py NamesByState --years 2021 --state-ranks result_all_states_all_names_1910_2020_5
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from name_choropleth_data import update_state_ranks_years
+from name_data import append_name_years
+from name_rank import NameCube, extend_year_range, update_year_ranges
+
+
+def update_national_ranks(names_cube, national_file, years, year_range, sexes):
+    """
+    Update (or create) a national Name x year bucket rank table saved as parquet.
+    The year range of an existing table comes from its columns
+    """
+    national_file = Path(national_file)
+    if national_file.exists():
+        rank_df = pd.read_parquet(national_file)
+        starts = [int(c) for c in rank_df.columns]
+        step = starts[1] - starts[0] if len(starts) > 1 else year_range.step
+        year_range = range(starts[0], starts[-1] + step, step)
+        rank_df, year_range = update_year_ranges(rank_df, names_cube, year_range, ['All'], sexes, years)
+    else:
+        year_range = extend_year_range(year_range, years)
+        rank_df = names_cube.rank_year_ranges(year_range, ['All'], sexes)
+    rank_df.to_parquet(national_file)
+    return year_range
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add newly published years to the names store and recompute only the affected year buckets '
+                    'of the state and national rank tables. Only the changed source files are parsed, but the '
+                    'store and every partition of the state ranks are rewritten, so when all the state files '
+                    'changed the store step takes about as long as a full rebuild.')
+    parser.add_argument('names_path', help='directory with the SSA state .TXT files, already including the new years')
+    parser.add_argument('--years', type=int, nargs='+', required=True, help='the new (or revised) years')
+    parser.add_argument('--state-ranks', help='dataset directory written by build_choropleth_parquet.py')
+    parser.add_argument('--national-ranks', help='national rank table parquet file, created if missing')
+    parser.add_argument('--start', type=int, default=1910, help='first year of a new national table (default 1910)')
+    parser.add_argument('--step', type=int, default=5, help='years per bucket of a new national table (default 5)')
+    parser.add_argument('--sexes', default='MF', help='sexes of the national table, M, F or MF (default MF)')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    names_df = append_name_years(args.names_path, args.years)
+    print(f'Names store updated with {args.years} in {time.perf_counter() - start_time:.1f} s')
+
+    if args.state_ranks:
+        start_time = time.perf_counter()
+        buckets = update_state_ranks_years(names_df, args.state_ranks, args.years, files_path=args.names_path)
+        print(f'State ranks buckets {buckets} recomputed in {time.perf_counter() - start_time:.1f} s')
+
+    if args.national_ranks:
+        start_time = time.perf_counter()
+        year_range = update_national_ranks(NameCube(names_df), args.national_ranks, args.years,
+                                           range(args.start, args.start + args.step, args.step), list(args.sexes))
+        print(f'National ranks {year_range} updated in {time.perf_counter() - start_time:.1f} s')
+
+
+if __name__ == '__main__':
+    main()